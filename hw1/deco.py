@@ -1,7 +1,34 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from functools import update_wrapper
+import io
+import sys
+import time
+import asyncio
+import inspect
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from functools import partial, update_wrapper
+
+MEMO_ATTRIBUTES = ("cache", "hits", "misses", "evictions", "cache_clear")
+# separates positional and keyword arguments in memo keys
+KWARGS_MARK = object()
+# returned by get_cached, when value isn't cached
+MISSING = object()
+# latency histogram buckets of profiled functions: bucket i counts calls,
+# which took from 2 ** (i - 1) to 2 ** i microseconds
+HISTOGRAM_SIZE = 32
+PROFILE_REPORT_ORDERS = ("calls", "total_time", "self_time", "mean_time")
+
+# prefix of names in wrappers generated by fuse
+FUSED_PREFIX = "_fused_"
+
+# stats of profiled functions by name
+PROFILE_REGISTRY = {}
+# stack of time spent in nested profiled calls in every thread
+profile_stack = threading.local()
 
 
 def disable(func):
@@ -37,23 +64,322 @@ def countcalls(func):
 
 
 @decorator
-def memo(func):
+def threadsafe_countcalls(func):
+    """Thread-safe version of countcalls"""
+    lock = threading.Lock()
+
+    def wrapper(*args, **kwargs):
+        with lock:
+            wrapper.calls += 1
+        return func(*args, **kwargs)
+    wrapper.calls = 0
+    return wrapper
+
+
+def freeze(value):
+    """
+    Convert unhashable value (list, dict, set or their nesting)
+    to hashable one, values of different types don't collide.
+    Raise TypeError if value can't be converted
+    """
+    if isinstance(value, (tuple, list)):
+        return type(value), tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return type(value), frozenset(
+            (key, freeze(item)) for key, item in value.items()
+        )
+    if isinstance(value, (set, frozenset)):
+        return type(value), frozenset(value)
+
+    hash(value)
+    return value
+
+
+def freeze_key(key):
+    """
+    Freeze unhashable key, return None if it can't be frozen
+    (values with equal repr can differ, so repr isn't used as key)
+    """
+    try:
+        return freeze(key)
+    except TypeError:
+        return None
+
+
+def make_key(args, kwargs):
+    """
+    Make cache key from function arguments: tuple of arguments
+    if they are hashable, otherwise frozen arguments.
+    Return None if arguments can't be frozen: call isn't cached
+    """
+    key = args
+    if kwargs:
+        key += (KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+
+    try:
+        hash(key)
+    except TypeError:
+        return freeze_key(key)
+    return key
+
+
+def update_attributes(wrapper, func, own_attributes=()):
+    """
+    Copy attributes of decorated function, which could be changed
+    by the call (like calls of countcalls), to wrapper
+    """
+    for name, value in func.__dict__.items():
+        if name not in own_attributes and name != "__wrapped__":
+            setattr(wrapper, name, value)
+
+
+def check_memo_options(maxsize, ttl):
+    if maxsize is not None and maxsize <= 0:
+        raise ValueError("maxsize must be positive or None")
+    if ttl is not None and ttl <= 0:
+        raise ValueError("ttl must be positive or None")
+
+
+def init_memo(wrapper):
+    """
+    Add empty cache and statistics to memoizing wrapper
+    """
+    def cache_clear():
+        wrapper.cache.clear()
+        wrapper.hits = wrapper.misses = wrapper.evictions = 0
+
+    wrapper.cache = OrderedDict()
+    wrapper.cache_clear = cache_clear
+    cache_clear()
+    return wrapper
+
+
+def get_cached(wrapper, key, maxsize, timer):
+    """
+    Get value from wrapper.cache, count hit or eviction of expired value.
+    Return MISSING if value isn't cached
+    """
+    cache = wrapper.cache
+    if key in cache:
+        value, expires = cache[key]
+        if expires is None or timer() < expires:
+            if maxsize is not None:
+                cache.move_to_end(key)
+            wrapper.hits += 1
+            return value
+
+        del cache[key]
+        wrapper.evictions += 1
+
+    return MISSING
+
+
+def set_cached(wrapper, key, value, maxsize, ttl, timer):
+    """
+    Put value to wrapper.cache, evict the least recently used value
+    if cache is full. Without maxsize values are not reordered on hits,
+    so expired values are at the beginning of cache and are evicted
+    """
+    cache = wrapper.cache
+    if ttl is None:
+        cache[key] = value, None
+    else:
+        now = timer()
+        if maxsize is None:
+            while cache:
+                expires = next(iter(cache.values()))[1]
+                if now < expires:
+                    break
+                cache.popitem(last=False)
+                wrapper.evictions += 1
+        cache[key] = value, now + ttl
+
+    if maxsize is not None and len(cache) > maxsize:
+        cache.popitem(last=False)
+        wrapper.evictions += 1
+
+
+def memo(func=None, maxsize=None, ttl=None, timer=time.monotonic):
+    """
+    Memoize a function so that it caches return values for
+    faster future lookups. Can be used without arguments or with options:
+
+    @memo(maxsize=1000, ttl=60)
+    def get_user(user_id):
+        ....
+
+    maxsize - max count of cached values, the least recently used
+    value is evicted from full cache (unlimited if None)
+    ttl - seconds after which cached value expires (never if None),
+    expired values are evicted when new values are cached
+
+    Calls with unhashable arguments, which can't be frozen
+    (not lists, dicts or sets), are not cached and counted as misses.
+
+    Statistics are kept in wrapper.hits, wrapper.misses and
+    wrapper.evictions (expired values are counted as evicted),
+    wrapper.cache_clear() removes all cached values.
+    """
+    check_memo_options(maxsize, ttl)
+    if func is None:
+        def deco(func):
+            return memo(func, maxsize, ttl, timer)
+
+        deco.fuse_fragment = partial(
+            memo_fragment, maxsize=maxsize, ttl=ttl, timer=timer
+        )
+        return deco
+
+    def wrapper(*args, **kwargs):
+        key = make_key(args, kwargs)
+        if key is None:
+            wrapper.misses += 1
+            return func(*args, **kwargs)
+
+        value = get_cached(wrapper, key, maxsize, timer)
+        if value is not MISSING:
+            return value
+
+        wrapper.misses += 1
+        value = func(*args, **kwargs)
+        set_cached(wrapper, key, value, maxsize, ttl, timer)
+        # attributes of func can change only when it is called
+        update_attributes(wrapper, func, MEMO_ATTRIBUTES)
+        return value
+
+    return init_memo(update_wrapper(wrapper, func))
+
+
+class PendingCall:
+    """
+    Call of memoized function, which is being computed by one thread,
+    while other threads are waiting for its result
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def threadsafe_memo(func=None, maxsize=None, ttl=None, timer=time.monotonic):
     """
-    Memoize a function so that it caches all return values for
-    faster future lookups.
+    Thread-safe version of memo. If several threads call the function
+    with the same arguments at once, it is computed only once:
+    other threads wait for the result (they are counted as hits)
+    and get the same value or exception. Exceptions are not cached.
     """
+    check_memo_options(maxsize, ttl)
+    if func is None:
+        return lambda func: threadsafe_memo(func, maxsize, ttl, timer)
+
+    lock = threading.Lock()
+    pending_calls = {}
+
     def wrapper(*args, **kwargs):
-        update_wrapper(wrapper, func)
-        key = str(args) + str(kwargs)
-        if key not in wrapper.cache:
-            wrapper.cache[key] = func(*args, **kwargs)
+        key = make_key(args, kwargs)
+        with lock:
+            if key is None:
+                wrapper.misses += 1
+        if key is None:
+            return func(*args, **kwargs)
+
+        with lock:
+            value = get_cached(wrapper, key, maxsize, timer)
+            if value is not MISSING:
+                return value
+
+            call = pending_calls.get(key)
+            if call is None:
+                call = pending_calls[key] = PendingCall()
+                wrapper.misses += 1
+                is_owner = True
+            else:
+                wrapper.hits += 1
+                is_owner = False
+
+        if not is_owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = func(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        else:
+            with lock:
+                set_cached(wrapper, key, call.value, maxsize, ttl, timer)
+                update_attributes(wrapper, func, MEMO_ATTRIBUTES)
+        finally:
+            with lock:
+                del pending_calls[key]
+            call.done.set()
+
+        return call.value
 
-        return wrapper.cache[key]
+    init_memo(update_wrapper(wrapper, func))
+    cache_clear = wrapper.cache_clear
 
-    wrapper.cache = {}
+    def locked_cache_clear():
+        with lock:
+            cache_clear()
+
+    wrapper.cache_clear = locked_cache_clear
     return wrapper
 
 
+def async_memo(func=None, maxsize=None, ttl=None, timer=time.monotonic):
+    """
+    Version of memo for coroutine functions, which caches awaited results:
+
+    @async_memo(maxsize=10000, ttl=600)
+    async def fetch(url):
+        ....
+
+    If coroutines await the function with the same arguments at once,
+    it is awaited only once and they share the result (they are counted
+    as hits). Cancellation of one waiter doesn't cancel the computation
+    for others. Exceptions are not cached.
+    """
+    check_memo_options(maxsize, ttl)
+    if func is None:
+        return lambda func: async_memo(func, maxsize, ttl, timer)
+
+    pending_tasks = {}
+
+    def on_done(key, task):
+        del pending_tasks[key]
+        if not task.cancelled() and task.exception() is None:
+            set_cached(wrapper, key, task.result(), maxsize, ttl, timer)
+            update_attributes(wrapper, func, MEMO_ATTRIBUTES)
+
+    async def wrapper(*args, **kwargs):
+        key = make_key(args, kwargs)
+        if key is None:
+            wrapper.misses += 1
+            return await func(*args, **kwargs)
+
+        value = get_cached(wrapper, key, maxsize, timer)
+        if value is not MISSING:
+            return value
+
+        task = pending_tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda task: on_done(key, task))
+            pending_tasks[key] = task
+            wrapper.misses += 1
+        else:
+            wrapper.hits += 1
+
+        return await asyncio.shield(task)
+
+    return init_memo(update_wrapper(wrapper, func))
+
+
 @decorator
 def n_ary(func):
     """
@@ -110,9 +436,469 @@ def trace(indent="___"):
 
         wrapper.level = 0
         return wrapper
+
+    decorate.fuse_fragment = partial(trace_fragment, indent=indent)
+    return decorate
+
+
+class FusedWrapperBuilder:
+    """
+    Generator of one wrapper for a chain of fusible decorators, which has
+    the same signature as decorated function. Every decorator provides
+    fragment(builder, body): function, which returns lines of code
+    wrapped around body lines. Body computes _fused_result, the innermost
+    body calls decorated function. Parameters can shadow any global name,
+    so fragments refer to builtins and helpers only by names from add_name.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.namespace = {FUSED_PREFIX + "func": func}
+        # functions, which initialize attributes of created wrapper
+        self.init_funcs = []
+
+        params = []
+        call_args = []
+        positional = []
+        keywords = []
+        var_args = None
+        var_kwargs = None
+        after_positional_only = False
+        signature = inspect.signature(func, follow_wrapped=False)
+        for param in signature.parameters.values():
+            param_code = param.name
+            if param.default is not param.empty:
+                param_code += "=" + self.add_name(param.default, "default")
+
+            if param.kind != param.POSITIONAL_ONLY and after_positional_only:
+                params.append("/")
+                after_positional_only = False
+
+            if param.kind in (param.POSITIONAL_ONLY,
+                              param.POSITIONAL_OR_KEYWORD):
+                after_positional_only = param.kind == param.POSITIONAL_ONLY
+                params.append(param_code)
+                call_args.append(param.name)
+                positional.append(param.name)
+            elif param.kind == param.VAR_POSITIONAL:
+                var_args = param.name
+                params.append("*" + param.name)
+                call_args.append("*" + param.name)
+            elif param.kind == param.KEYWORD_ONLY:
+                if var_args is None and "*" not in params:
+                    params.append("*")
+                params.append(param_code)
+                call_args.append("{0}={0}".format(param.name))
+                keywords.append(param.name)
+            else:
+                var_kwargs = param.name
+                params.append("**" + param.name)
+                call_args.append("**" + param.name)
+
+        if after_positional_only:
+            params.append("/")
+
+        self.param_names = positional + keywords + [
+            name for name in (var_args, var_kwargs) if name
+        ]
+        self.params_code = ", ".join(params)
+        self.call_code = "{}func({})".format(
+            FUSED_PREFIX, ", ".join(call_args)
+        )
+
+        # positional and keyword arguments as tuple and dict
+        self.args_code = "({},)".format(", ".join(positional)) \
+            if positional else "()"
+        if var_args:
+            self.args_code = var_args if not positional \
+                else self.args_code + " + " + var_args
+        self.kwargs_code = None
+        if keywords or var_kwargs:
+            items = ['"{0}": {0}'.format(name) for name in keywords]
+            if var_kwargs:
+                items.append("**" + var_kwargs)
+            self.kwargs_code = "{{{}}}".format(", ".join(items))
+
+    def is_fusible(self):
+        """Names of parameters don't clash with names of wrapper"""
+        return not any(
+            name.startswith(FUSED_PREFIX) for name in self.param_names
+        )
+
+    def add_name(self, value, hint):
+        """Add value to globals of wrapper, return its name"""
+        name = "{}{}_{}".format(FUSED_PREFIX, hint, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def get_key_lines(self):
+        """
+        Lines of code, which compute cache key of arguments
+        (None if call can't be cached, see make_key)
+        """
+        if self.kwargs_code is not None:
+            return ["{0}key = {1}({2}, {3})".format(
+                FUSED_PREFIX, self.add_name(make_key, "make_key"),
+                self.args_code, self.kwargs_code
+            )]
+
+        return [line.format(
+            prefix=FUSED_PREFIX, args=self.args_code,
+            hash=self.add_name(hash, "hash"),
+            type_error=self.add_name(TypeError, "TypeError"),
+            freeze_key=self.add_name(freeze_key, "freeze_key")
+        ) for line in [
+            "{prefix}key = {args}",
+            "try:",
+            "    {hash}({prefix}key)",
+            "except {type_error}:",
+            "    {prefix}key = {freeze_key}({prefix}key)",
+        ]]
+
+    def build(self, fragments):
+        """
+        Create wrapper from fragments of decorators (from the innermost)
+        """
+        body = ["{}result = {}".format(FUSED_PREFIX, self.call_code)]
+        for fragment in fragments:
+            body = fragment(self, body)
+
+        source = "def {}wrapper({}):\n{}\n    return {}result\n".format(
+            FUSED_PREFIX, self.params_code,
+            "\n".join("    " + line for line in body), FUSED_PREFIX
+        )
+        filename = "<fused {}>".format(self.func.__qualname__)
+        exec(compile(source, filename, "exec"), self.namespace)
+
+        wrapper = update_wrapper(
+            self.namespace[FUSED_PREFIX + "wrapper"], self.func
+        )
+        for init_func in self.init_funcs:
+            init_func(wrapper)
+        wrapper.fused_source = source
+        return wrapper
+
+
+def countcalls_fragment(builder, body):
+    builder.init_funcs.append(lambda wrapper: setattr(wrapper, "calls", 0))
+    return ["{}wrapper.calls += 1".format(FUSED_PREFIX)] + body
+
+
+def memo_fragment(builder, body, maxsize=None, ttl=None, timer=time.monotonic):
+    check_memo_options(maxsize, ttl)
+    builder.init_funcs.append(init_memo)
+    if maxsize is None and ttl is None:
+        # without eviction lookup is inlined and values aren't expired
+        lookup = [
+            "if {prefix}key is not None "
+            "and {prefix}key in {prefix}wrapper.cache:",
+            "    {prefix}wrapper.hits += 1",
+            "    {prefix}result = {prefix}wrapper.cache[{prefix}key][0]",
+            "else:",
+            "    {prefix}wrapper.misses += 1",
+        ]
+        store = [
+            "    if {prefix}key is not None:",
+            "        {prefix}wrapper.cache[{prefix}key] = "
+            "{prefix}result, None",
+        ]
+        names = {"prefix": FUSED_PREFIX}
+    else:
+        lookup = [
+            "{prefix}value = {get_cached}("
+            "{prefix}wrapper, {prefix}key, {maxsize}, {timer}) "
+            "if {prefix}key is not None else {missing}",
+            "if {prefix}value is not {missing}:",
+            "    {prefix}result = {prefix}value",
+            "else:",
+            "    {prefix}wrapper.misses += 1",
+        ]
+        store = [
+            "    if {prefix}key is not None:",
+            "        {set_cached}({prefix}wrapper, {prefix}key, "
+            "{prefix}result, {maxsize}, {ttl}, {timer})",
+        ]
+        names = {
+            "prefix": FUSED_PREFIX,
+            "get_cached": builder.add_name(get_cached, "get_cached"),
+            "set_cached": builder.add_name(set_cached, "set_cached"),
+            "missing": builder.add_name(MISSING, "missing"),
+            "maxsize": builder.add_name(maxsize, "maxsize"),
+            "ttl": builder.add_name(ttl, "ttl"),
+            "timer": builder.add_name(timer, "timer"),
+        }
+
+    return builder.get_key_lines() + \
+        [line.format(**names) for line in lookup] + \
+        ["    " + line for line in body] + \
+        [line.format(**names) for line in store]
+
+
+def trace_fragment(builder, body, indent="___"):
+    builder.init_funcs.append(lambda wrapper: setattr(wrapper, "level", 0))
+    names = {
+        "prefix": FUSED_PREFIX,
+        "indent": builder.add_name(indent, "indent"),
+        "name": builder.add_name(builder.func.__name__, "name"),
+        "args": builder.args_code,
+        "str": builder.add_name(str, "str"),
+        "print": builder.add_name(print, "print"),
+    }
+    before = [
+        '{prefix}params = ", ".join('
+        '[{str}({prefix}arg) for {prefix}arg in {args}])',
+        '{print}("{{}} --> {{}}({{}})".format('
+        '{indent} * {prefix}wrapper.level, {name}, {prefix}params))',
+        "{prefix}wrapper.level += 1",
+    ]
+    after = [
+        "{prefix}wrapper.level -= 1",
+        '{print}("{{}} <-- {{}}({{}}) == {{}}".format('
+        '{indent} * {prefix}wrapper.level, {name}, {prefix}params, '
+        '{prefix}result))',
+    ]
+    return [line.format(**names) for line in before] + body + \
+        [line.format(**names) for line in after]
+
+
+countcalls.fuse_fragment = countcalls_fragment
+memo.fuse_fragment = memo_fragment
+
+
+def fuse_fragments(func, fragments):
+    """
+    Apply fragments of decorators (from the innermost) to func
+    by one generated wrapper
+    """
+    if not fragments:
+        return func
+
+    builder = FusedWrapperBuilder(func)
+    if not builder.is_fusible():
+        raise ValueError("Parameters of {} can't start with {}".format(
+            func.__qualname__, FUSED_PREFIX
+        ))
+    return builder.build(fragments)
+
+
+def fuse(*decorators):
+    """
+    Compose decorators like stacking them (the first one is the outermost),
+    but with one call frame for a chain of fusible decorators
+    (countcalls, memo, trace) instead of frame per decorator:
+
+    @fuse(countcalls, trace("####"), memo)
+    def fib(n):
+        ....
+
+    Fused wrapper is generated with the signature of decorated function,
+    so arguments aren't packed to *args and **kwargs. If a decorator
+    isn't fusible or is repeated in a chain, it is applied as usual
+    and a new chain is started. Attributes of fused decorators
+    (calls, cache, level, ...) are kept in the fused wrapper, its source
+    is in wrapper.fused_source.
+    """
+    def decorate(func):
+        fragments = []
+        kinds = set()
+        for deco in reversed(decorators):
+            fragment = getattr(deco, "fuse_fragment", None)
+            kind = getattr(fragment, "func", fragment)
+            if fragment is None or kind in kinds:
+                func = fuse_fragments(func, fragments)
+                fragments = []
+                kinds = set()
+
+            if fragment is None:
+                func = deco(func)
+            else:
+                fragments.append(fragment)
+                kinds.add(kind)
+
+        return fuse_fragments(func, fragments)
+
     return decorate
 
 
+class ProfileStats:
+    """
+    Statistics of profiled function: count of all calls, and for sampled
+    calls - cumulative time, self time (excluding time of directly nested
+    profiled calls) and latency histogram. Times of all calls are estimated
+    by scaling times of sampled calls.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # calls are counted without lock by next() of counter (atomic
+        # under GIL), reading of count takes a value too, so reads are
+        # subtracted
+        self.counter = itertools.count(1)
+        self.reads = 0
+        self.sampled = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.histogram = [0] * HISTOGRAM_SIZE
+
+    @property
+    def calls(self):
+        with self.lock:
+            self.reads += 1
+            return next(self.counter) - self.reads
+
+    def add(self, elapsed, children_time=0.0):
+        bucket = min(int(elapsed * 1e6).bit_length(), HISTOGRAM_SIZE - 1)
+        with self.lock:
+            self.sampled += 1
+            self.total_time += elapsed
+            self.self_time += elapsed - children_time
+            self.histogram[bucket] += 1
+
+    def get_scale(self):
+        """Ratio of all calls to sampled calls"""
+        return self.calls / self.sampled if self.sampled else 0.0
+
+    def get_mean_time(self):
+        return self.total_time / self.sampled if self.sampled else 0.0
+
+    def get_percentile(self, percent):
+        """Upper bound of latency percentile by histogram, in seconds"""
+        rank = self.sampled * percent / 100
+        count = 0
+        for bucket, bucket_count in enumerate(self.histogram):
+            count += bucket_count
+            if count and count >= rank:
+                return 2 ** bucket / 1e6
+        return 0.0
+
+
+def profiled(func=None, name=None, sample_rate=1.0, self_time=True):
+    """
+    Collect statistics of calls of function decorated to PROFILE_REGISTRY
+    (by module and qualified name of function, if name isn't set).
+    Only every (1 / sample_rate)-th call is recorded, others are just
+    counted (or timed without recording, if they are nested in recorded
+    call, to exclude their time from its self time):
+
+    @profiled(sample_rate=0.01)
+    def parse_line(line):
+        ....
+
+    Self time isn't measured if self_time is False (see timed).
+    Coroutine functions are timed until coroutine is created, not awaited.
+    """
+    if not 0 < sample_rate <= 1:
+        raise ValueError("sample_rate must be in (0, 1]")
+    if func is None:
+        return lambda func: profiled(func, name, sample_rate, self_time)
+
+    if name is None:
+        name = "{}.{}".format(func.__module__, func.__qualname__)
+    stats = PROFILE_REGISTRY[name] = ProfileStats(name)
+    sample_period = max(1, round(1 / sample_rate))
+    perf_counter = time.perf_counter
+
+    def timed_wrapper(*args, **kwargs):
+        sampled = not next(stats.counter) % sample_period
+        if not sampled:
+            return func(*args, **kwargs)
+
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.add(perf_counter() - start)
+
+    def profiled_wrapper(*args, **kwargs):
+        sampled = not next(stats.counter) % sample_period
+
+        # unsampled call is timed only inside other timed call,
+        # to exclude its time from self time of the caller
+        children_times = getattr(profile_stack, "children_times", None)
+        if not sampled and not children_times:
+            return func(*args, **kwargs)
+        if children_times is None:
+            children_times = profile_stack.children_times = []
+
+        children_times.append(0.0)
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - start
+            children_time = children_times.pop()
+            if children_times:
+                children_times[-1] += elapsed
+            if sampled:
+                stats.add(elapsed, children_time)
+
+    wrapper = update_wrapper(
+        profiled_wrapper if self_time else timed_wrapper, func
+    )
+    wrapper.stats = stats
+    return wrapper
+
+
+def timed(func=None, name=None, sample_rate=1.0):
+    """
+    Cheaper version of profiled, which doesn't measure self time
+    (and time of its calls isn't excluded from self time of callers)
+    """
+    return profiled(func, name, sample_rate, self_time=False)
+
+
+def profile_report(order_by="total_time", limit=None):
+    """
+    Text report of profiled functions: count of calls, estimated total
+    and self time of all calls, mean time and latency percentiles
+    of sampled calls, ordered by order_by descending
+    """
+    if order_by not in PROFILE_REPORT_ORDERS:
+        msg = "order_by must be one of: {}"
+        raise ValueError(msg.format(", ".join(PROFILE_REPORT_ORDERS)))
+
+    sort_keys = {
+        "calls": lambda stats: stats.calls,
+        "total_time": lambda stats: stats.total_time * stats.get_scale(),
+        "self_time": lambda stats: stats.self_time * stats.get_scale(),
+        "mean_time": lambda stats: stats.get_mean_time(),
+    }
+    stats_list = sorted(PROFILE_REGISTRY.values(), key=sort_keys[order_by],
+                        reverse=True)[:limit]
+
+    row_template = "{:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}  {}"
+    lines = [row_template.format("calls", "sampled", "total_s", "self_s",
+                                 "mean_ms", "p50_ms", "p99_ms", "name")]
+    for stats in stats_list:
+        lines.append(row_template.format(
+            stats.calls,
+            stats.sampled,
+            "{:.4f}".format(stats.total_time * stats.get_scale()),
+            "{:.4f}".format(stats.self_time * stats.get_scale()),
+            "{:.4f}".format(stats.get_mean_time() * 1e3),
+            "{:.4f}".format(stats.get_percentile(50) * 1e3),
+            "{:.4f}".format(stats.get_percentile(99) * 1e3),
+            stats.name
+        ))
+    return "\n".join(lines)
+
+
+def dump_profile(file=None, order_by="total_time", limit=None):
+    """Print profile_report to file (stderr by default)"""
+    print(profile_report(order_by, limit), file=file or sys.stderr)
+
+
+def reset_profile():
+    """Reset statistics of all profiled functions"""
+    for stats in PROFILE_REGISTRY.values():
+        with stats.lock:
+            stats.reset()
+
+
 @memo
 @countcalls
 @n_ary
@@ -135,6 +921,17 @@ def fib(n):
     return 1 if n <= 1 else fib(n-1) + fib(n-2)
 
 
+@fuse(countcalls, trace("####"), memo)
+def fused_fib(n):
+    """Same as fib, but with one call frame per call"""
+    return 1 if n <= 1 else fused_fib(n-1) + fused_fib(n-2)
+
+
+@memo(maxsize=2)
+def square(x):
+    return x * x
+
+
 def main():
     print(foo(4, 3))
     print(foo(4, 3, 2))
@@ -150,6 +947,384 @@ def main():
     fib(3)
     print(fib.calls, 'calls made')
 
+    fused_fib(3)
+    print(fused_fib.calls, 'calls made')
+
+    for x in [1, 2, 1, 3, 2]:
+        square(x)
+    print("square: {} hits, {} misses, {} evictions".format(
+        square.hits, square.misses, square.evictions
+    ))
+
+    # defined here to not register in PROFILE_REGISTRY on import
+    @profiled(name="profiled_square", sample_rate=0.5)
+    def profiled_square(x):
+        return square(x)
+
+    @profiled(name="sum_squares")
+    def sum_squares(n):
+        return sum(profiled_square(x) for x in range(n))
+
+    sum_squares(1000)
+    dump_profile(sys.stdout)
+
+
+def test_memo_lru():
+    print("test_memo_lru...")
+
+    @memo(maxsize=2)
+    def double(x):
+        return x * 2
+
+    for x in [1, 2, 1, 3, 2]:
+        double(x)
+    assert (double.hits, double.misses, double.evictions) == (1, 4, 2)
+    assert list(double.cache) == [(3,), (2,)]
+
+    double.cache_clear()
+    assert not double.cache and double.hits == double.misses == 0
+    print('OK')
+
+
+def test_memo_ttl():
+    print("test_memo_ttl...")
+    now = [0.0]
+
+    @memo(ttl=10, timer=lambda: now[0])
+    def identity(x):
+        return x
+
+    for x in range(1000):
+        identity(x)
+    now[0] = 5
+    identity(0)
+    assert identity.hits == 1 and len(identity.cache) == 1000
+
+    # expired values are evicted, when a new value is cached
+    now[0] = 20
+    identity(1000)
+    assert list(identity.cache) == [(1000,)] and identity.evictions == 1000
+    identity(0)
+    assert identity.misses == 1002
+    print('OK')
+
+
+class Values:
+    """Unhashable sequence with truncated repr (like numpy array)"""
+    __hash__ = None
+
+    def __init__(self, *values):
+        self.values = values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __repr__(self):
+        return "Values(...)"
+
+
+def test_memo_keys():
+    print("test_memo_keys...")
+
+    @memo
+    def total(values, **options):
+        return sum(values) * options.get("scale", 1)
+
+    assert total([1, 2]) == total([1, 2]) == total((1, 2)) == 3
+    assert total.hits == 1 and total.misses == 2
+    assert total([1, 2], scale=2) == total([1, 2], scale=2) == 6
+    assert total.hits == 2 and len(total.cache) == 3
+
+    # values with equal repr aren't confused, they are not cached
+    assert total(Values(0, 0)) == 0
+    assert total(Values(0, 7)) == 7
+    assert total.misses == 5 and len(total.cache) == 3
+    print('OK')
+
+
+def wait_for(condition, timeout=5):
+    """Wait until condition() is true"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timeout"
+        time.sleep(0.001)
+
+
+def test_threadsafe_memo():
+    print("test_threadsafe_memo...")
+    release = threading.Event()
+    computed = []
+
+    @threadsafe_memo
+    def compute(x):
+        computed.append(x)
+        release.wait()
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    for x, expected in [(1, 2), (-1, ValueError)]:
+        results = []
+
+        def call():
+            try:
+                results.append(compute(x))
+            except ValueError as error:
+                results.append(type(error))
+
+        release.clear()
+        hits = compute.hits
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        # all threads except computing one wait for its result
+        wait_for(lambda: compute.hits == hits + 7)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == [expected] * 8
+
+    assert computed == [1, -1] and compute.misses == 2
+    # exceptions are not cached
+    assert list(compute.cache) == [(1,)]
+    try:
+        compute(-1)
+    except ValueError:
+        pass
+    assert computed == [1, -1, -1]
+    print('OK')
+
+
+def test_threadsafe_countcalls():
+    print("test_threadsafe_countcalls...")
+    counted = threadsafe_countcalls(lambda: None)
+
+    def call():
+        for _ in range(10000):
+            counted()
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counted.calls == 40000
+    print('OK')
+
+
+def test_async_memo():
+    print("test_async_memo...")
+    fetched = []
+
+    @async_memo(maxsize=10)
+    async def fetch(url):
+        fetched.append(url)
+        await asyncio.sleep(0.01)
+        if url == "bad":
+            raise ValueError(url)
+        return url.upper()
+
+    async def run():
+        results = await asyncio.gather(*[fetch("a") for _ in range(5)])
+        assert results == ["A"] * 5
+        assert fetched == ["a"] and fetch.hits == 4 and fetch.misses == 1
+        assert await fetch("a") == "A" and fetch.hits == 5
+
+        # cancellation of one waiter doesn't cancel computation for others
+        tasks = [asyncio.ensure_future(fetch("b")) for _ in range(3)]
+        await asyncio.sleep(0)
+        tasks[0].cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert results[1:] == ["B", "B"] and fetched == ["a", "b"]
+
+        for _ in range(2):
+            try:
+                await fetch("bad")
+            except ValueError:
+                pass
+        assert fetched == ["a", "b", "bad", "bad"]
+
+    asyncio.run(run())
+    print('OK')
+
+
+def test_profiled_self_time():
+    print("test_profiled_self_time...")
+
+    @profiled(name="test.leaf")
+    def leaf():
+        time.sleep(0.002)
+
+    @profiled(name="test.middle", sample_rate=0.5)
+    def middle():
+        leaf()
+
+    @profiled(name="test.root")
+    def root():
+        for _ in range(10):
+            middle()
+
+    root()
+    root_stats = PROFILE_REGISTRY["test.root"]
+    middle_stats = PROFILE_REGISTRY["test.middle"]
+    leaf_stats = PROFILE_REGISTRY["test.leaf"]
+    assert (middle_stats.calls, middle_stats.sampled) == (10, 5)
+    assert leaf_stats.self_time == leaf_stats.total_time >= 0.02
+    # time of unsampled middle calls isn't excluded twice
+    assert 0 <= root_stats.self_time < 0.005
+    assert 0 <= middle_stats.self_time < 0.005
+    print('OK')
+
+
+def test_profiled_sampling():
+    print("test_profiled_sampling...")
+
+    @timed(name="test.sampled", sample_rate=0.25)
+    def sampled(x):
+        return x
+
+    def call():
+        for x in range(10000):
+            sampled(x)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = sampled.stats
+    assert stats.calls == 40000 and stats.sampled == 10000
+    assert sum(stats.histogram) == stats.sampled
+    assert 0 < stats.get_percentile(50) <= stats.get_percentile(99)
+    assert stats.get_scale() == 4
+    assert "test.sampled" in profile_report(order_by="calls", limit=1)
+
+    reset_profile()
+    assert stats.calls == stats.sampled == 0 and not any(stats.histogram)
+    print('OK')
+
+
+def test_fuse_signatures():
+    print("test_fuse_signatures...")
+
+    def positional_only(a, b=2, /, c=3):
+        return a, b, c
+
+    def keyword_only(a, *, b, c=3):
+        return a, b, c
+
+    def var_args(a, *args):
+        return a, args
+
+    def var_kwargs(a, **kwargs):
+        return a, sorted(kwargs.items())
+
+    funcs_calls = {
+        positional_only: [((1,), {}), ((1, 5), {}), ((1, 5), {"c": 6}),
+                          ((1,), {})],
+        keyword_only: [((1,), {"b": 2}), ((1,), {"b": 2, "c": 4}),
+                       ((1,), {"b": [2]}), ((1,), {"b": 2})],
+        var_args: [((1,), {}), ((1, 2, 3), {}), ((1, [2]), {}),
+                   ((1, 2, 3), {})],
+        var_kwargs: [((1,), {}), ((1,), {"x": 2}), ((1,), {"x": {"y": 3}}),
+                     ((1,), {"x": 2})],
+    }
+    for func, calls in funcs_calls.items():
+        memoized = memo(func)
+        stacked = countcalls(memoized)
+        fused = fuse(countcalls, memo)(func)
+        signature = inspect.signature(fused, follow_wrapped=False)
+        assert signature == inspect.signature(func)
+        assert fused.__name__ == func.__name__
+
+        for args, kwargs in calls:
+            assert (fused(*args, **kwargs) == stacked(*args, **kwargs)
+                    == func(*args, **kwargs))
+        assert fused.calls == stacked.calls == len(calls)
+        assert (fused.hits, fused.misses) == (memoized.hits, memoized.misses)
+
+        for wrapper in [fused, stacked]:
+            try:
+                wrapper(b=1)
+            except TypeError:
+                pass
+            else:
+                assert False, "TypeError isn't raised"
+    print('OK')
+
+
+def test_fuse_trace():
+    print("test_fuse_trace...")
+
+    @countcalls
+    @trace("#")
+    @memo
+    def stacked_fib(n):
+        return 1 if n <= 1 else stacked_fib(n-1) + stacked_fib(n-2)
+
+    @fuse(countcalls, trace("#"), memo)
+    def fused_fib(n):
+        return 1 if n <= 1 else fused_fib(n-1) + fused_fib(n-2)
+
+    outputs = []
+    for fib_func in [stacked_fib, fused_fib]:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            assert fib_func(5) == 8
+        outputs.append(output.getvalue().replace(fib_func.__name__, "fib"))
+    assert outputs[0] == outputs[1]
+    assert stacked_fib.calls == fused_fib.calls == 9
+    print('OK')
+
+
+def test_fuse_chains():
+    print("test_fuse_chains...")
+
+    # parameters can have names of builtins
+    @fuse(trace("#"), memo)
+    def shadowed(str, hash=1, print=2, TypeError=3):
+        return str + hash + print + TypeError
+
+    with redirect_stdout(io.StringIO()):
+        assert shadowed(1) == shadowed(1) == 7
+    assert shadowed.hits == 1 and len(shadowed.cache) == 1
+
+    # n_ary isn't fusible, memo is repeated: three wrappers are created
+    @fuse(countcalls, memo(maxsize=1), n_ary, countcalls, memo)
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2, 3) == add(1, 2, 3) == 6
+    assert add.calls == 2 and add.hits == 1
+    inner = add.__wrapped__.__wrapped__
+    assert inner.calls == 2
+    assert "def _fused_wrapper(a, b)" in inner.fused_source
+
+    def identity(x):
+        return x
+
+    assert fuse()(identity) is identity
+    try:
+        fuse(memo)(lambda _fused_x: _fused_x)
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError isn't raised"
+    print('OK')
+
 
 if __name__ == '__main__':
     main()
+    test_memo_lru()
+    test_memo_ttl()
+    test_memo_keys()
+    test_threadsafe_memo()
+    test_threadsafe_countcalls()
+    test_async_memo()
+    test_profiled_self_time()
+    test_profiled_sampling()
+    test_fuse_signatures()
+    test_fuse_trace()
+    test_fuse_chains()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+import argparse
+import platform
+import tempfile
+from datetime import date
+
+import log_parser
+import log_analyzer
+import log_generator
+import report_generator
+
+SAMPLE_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] '
+    '"GET /api/v2/banner/25019354 HTTP/1.1" 200 927 "-" '
+    '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+    '"1498697422-2190034393-4508-9752759" "dc7161be3" 0.390\n',
+    '1.99.174.176 3b81f63526fa8  - [29/Jun/2017:03:50:22 +0300] '
+    '"GET /api/1/photogenic_banners/list/?server_name=WIN7RB4 HTTP/1.1" '
+    '200 12 "-" "Python-urllib/2.7" "-" '
+    '"1498697422-32900793-4708-9752770" "-" 0.133\n',
+    '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] '
+    '"GET /api/v2/group/1769230/banners HTTP/1.1" 200 1020 "-" '
+    '"Configovod" "-" "1498697422-2118016444-4708-9752747" '
+    '"712e90144abee9" 0.628\n',
+    'broken line without request\n',
+]
+
+
+def legacy_parse_log_line(line):
+    """
+    parse_log_line implementation before LogLineParser:
+    regex is compiled and applied with findall for every line
+    """
+    log_info = {"url": "", "is_error": True, "request_time": 0}
+
+    regex = re.compile(r"\"[A-Z]+ ([^\s]+) .* (\d+\.\d+)\n")
+    parsed_line = re.findall(regex, line)
+
+    if not parsed_line:
+        return log_info
+
+    log_info["url"] = parsed_line[0][0]
+    log_info["request_time"] = float(parsed_line[0][1])
+
+    if log_info["url"] and log_info["request_time"]:
+        log_info["is_error"] = False
+
+    return log_info
+
+
+def measure_lines_per_sec(parse_line, lines):
+    start = time.perf_counter()
+    for line in lines:
+        parse_line(line)
+    elapsed = time.perf_counter() - start
+
+    return len(lines) / elapsed
+
+
+def bench_line_parser(lines_count):
+    """
+    Compare speed of log line parsers
+    :return: dict {parser name: lines per second}
+    """
+    lines = SAMPLE_LINES * (lines_count // len(SAMPLE_LINES))
+
+    parsers = [
+        ("legacy parse_log_line", legacy_parse_log_line),
+        ("parse_log_line", log_parser.parse_log_line),
+        ("LogLineParser.parse", log_parser.LogLineParser().parse),
+    ]
+
+    return {
+        name: measure_lines_per_sec(parse_line, lines)
+        for name, parse_line in parsers
+    }
+
+
+def measure_time(func, *args, **kwargs):
+    """
+    Call func and measure its execution time
+    :return: tuple (result of func, seconds)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_stages(log_path, workers=1, report_size=1000):
+    """
+    Measure time of parse_log_file, analyze_log and save_report_html
+    for log file separately
+    :return: dict with log info, seconds of every stage and throughput
+    """
+    log_stats, parse_time = measure_time(
+        log_parser.parse_log_file, log_path, workers=workers
+    )
+    # Generated logs can have any share of errors
+    report_list, analyze_time = measure_time(
+        log_analyzer.analyze_log, log_stats, 100, report_size
+    )
+    with tempfile.TemporaryDirectory() as report_dir:
+        _, report_time = measure_time(
+            report_generator.save_report_html,
+            report_list, date.today(), report_dir
+        )
+
+    lines_count = log_analyzer.calc_log_rows_count(log_stats)
+    log_size = os.path.getsize(log_path)
+
+    return {
+        "log_path": log_path,
+        "log_size": log_size,
+        "lines": lines_count,
+        "urls": len(log_stats.urls),
+        "workers": workers,
+        "parse_log_file_sec": parse_time,
+        "analyze_log_sec": analyze_time,
+        "save_report_html_sec": report_time,
+        "parse_lines_per_sec": lines_count / parse_time,
+        "parse_mb_per_sec": log_size / parse_time / 2 ** 20,
+    }
+
+
+def bench_generated_log(lines_count, tmp_dir, args):
+    """
+    Generate synthetic log with settings from args and benchmark it
+    """
+    log_path = os.path.join(
+        tmp_dir, log_generator.get_log_name(date.today(), args.gzip)
+    )
+    log_generator.generate_log_file(
+        log_path, lines_count, args.urls, args.errors, args.seed
+    )
+    try:
+        return bench_stages(log_path, args.workers, args.report_size)
+    finally:
+        os.remove(log_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    help_msg = "count of lines for line parser benchmark (0 - skip it)"
+    parser.add_argument("-n", "--lines", type=int, default=200000,
+                        help=help_msg)
+    help_msg = "benchmark stages on existing log file (can be repeated)"
+    parser.add_argument("--log", action="append", default=[], help=help_msg)
+    help_msg = "benchmark stages on generated log with N lines " \
+               "(can be repeated)"
+    parser.add_argument("--generate", type=int, action="append", default=[],
+                        help=help_msg)
+    help_msg = "count of distinct urls in generated log"
+    parser.add_argument("--urls", type=int, default=1000, help=help_msg)
+    help_msg = "share of unparsable lines in generated log"
+    parser.add_argument("--errors", type=float, default=0.01, help=help_msg)
+    help_msg = "gzip generated log"
+    parser.add_argument("--gzip", action="store_true", help=help_msg)
+    help_msg = "seed of random generator"
+    parser.add_argument("--seed", type=int, default=0, help=help_msg)
+    help_msg = "count of processes for parsing uncompressed log"
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help=help_msg)
+    help_msg = "count of urls in report"
+    parser.add_argument("--report-size", type=int, default=1000,
+                        help=help_msg)
+    help_msg = "path to JSON file for results"
+    parser.add_argument("--json", type=str, help=help_msg)
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "line_parser": {},
+        "stages": [],
+    }
+
+    if args.lines:
+        results["line_parser"] = bench_line_parser(args.lines)
+        for name, lines_per_sec in results["line_parser"].items():
+            print("{:<25} {:>12,.0f} lines/sec".format(name, lines_per_sec))
+
+    for log_path in args.log:
+        results["stages"].append(
+            bench_stages(log_path, args.workers, args.report_size)
+        )
+
+    if args.generate:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for lines_count in args.generate:
+                results["stages"].append(
+                    bench_generated_log(lines_count, tmp_dir, args)
+                )
+
+    for stages in results["stages"]:
+        print(
+            "{lines:>12,} lines: parse {parse_log_file_sec:.3f} s "
+            "({parse_lines_per_sec:,.0f} lines/sec), "
+            "analyze {analyze_log_sec:.3f} s, "
+            "report {save_report_html_sec:.3f} s".format(**stages)
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="UTF-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from statistics import median
+import heapq
 
 
-def analyze_log(log_urls, max_errors_percent, report_size):
+def analyze_log(log_stats, max_errors_percent, report_size):
     """
-    Analyze parsed log_urls and prepare report_list
+    Analyze parsed log_stats and prepare report_list
     """
-    errors_percent = calc_errors_percent(log_urls)
+    errors_percent = calc_errors_percent(log_stats)
     if errors_percent > max_errors_percent:
         msg = "Log errors limit exceeded. " \
               "Errors percent: {}, " \
@@ -17,57 +17,72 @@ def analyze_log(log_urls, max_errors_percent, report_size):
             msg.format(errors_percent, max_errors_percent)
         )
 
-    report_list = prepare_report_list(log_urls, report_size)
+    report_list = prepare_report_list(log_stats, report_size)
     return report_list
 
 
-def calc_log_rows_count(log_urls):
-    good_rows_count = sum(len(u) for u in log_urls["urls_times"].values())
-    return log_urls["errors"] + good_rows_count
+def calc_log_rows_count(log_stats):
+    return log_stats.rows_count
 
 
-def calc_sum_request_time(log_urls):
-    return sum(
-        sum(url_times) for url_times in log_urls["urls_times"].values()
-    )
+def calc_sum_request_time(log_stats):
+    return log_stats.time_sum
 
 
-def calc_errors_percent(log_urls):
-    errors_percent = log_urls["errors"] * 100 / calc_log_rows_count(log_urls)
+def calc_errors_percent(log_stats):
+    errors_percent = log_stats.errors * 100 / calc_log_rows_count(log_stats)
     errors_percent = round(errors_percent, 3)
     return errors_percent
 
 
-def prepare_report_list(log_urls, report_size):
+def prepare_report_list(log_stats, report_size):
     urls_report = []
 
-    log_rows_count = calc_log_rows_count(log_urls)
-    sum_request_time = calc_sum_request_time(log_urls)
+    log_rows_count = calc_log_rows_count(log_stats)
+    sum_request_time = calc_sum_request_time(log_stats)
 
-    for url, url_times in log_urls["urls_times"].items():
+    for url, url_stats in select_top_urls(log_stats, report_size):
         url_info = dict()
 
         url_info["url"] = url
-        url_info["count"] = len(url_times)
+        url_info["count"] = url_stats.count
         url_info["count_perc"] = round(
             url_info["count"] * 100 / log_rows_count, 3
         )
 
-        url_info["time_sum"] = round(sum(url_times), 3)
+        url_info["time_sum"] = round(url_stats.time_sum, 3)
         url_info["time_perc"] = round(
             url_info["time_sum"] * 100 / sum_request_time, 3
         )
         url_info["time_avg"] = round(
             url_info["time_sum"] / url_info["count"], 3
         )
-        url_info["time_max"] = round(max(url_times), 3)
-        url_info["time_med"] = round(median(url_times), 3)
+        url_info["time_max"] = round(url_stats.time_max, 3)
+        url_info["time_med"] = round(url_stats.median(), 3)
+        for percent in log_stats.percentiles:
+            url_info[get_percentile_column(percent)] = round(
+                url_stats.percentile(percent), 3
+            )
 
         urls_report.append(url_info)
 
-    urls_report = sorted(
-        urls_report, key=lambda u: u["time_sum"], reverse=True
-    )
-    urls_report = urls_report[:report_size]
-
     return urls_report
+
+
+def get_percentile_column(percent):
+    """
+    Get report column name for percentile, e.g. time_p99 or time_p99.9
+    """
+    return "time_p{:g}".format(percent)
+
+
+def select_top_urls(log_stats, report_size):
+    """
+    Select report_size urls with max time_sum, sorted by time_sum desc.
+    Only selected urls need full stats (and median) calculation
+    """
+    return heapq.nlargest(
+        report_size,
+        log_stats.urls.items(),
+        key=lambda url_item: round(url_item[1].time_sum, 3)
+    )
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import random
+import argparse
+from datetime import date
+
+LOG_LINE_TEMPLATE = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] '
+    '"GET {url} HTTP/1.1" 200 927 "-" '
+    '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+    '"1498697422-2190034393-4508-9752759" "dc7161be3" {time:.3f}\n'
+)
+ERROR_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "0" 400 166 "-" '
+    '"-" "-" "-" "-" 0.000\n',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] '
+    '"GET /api/v2/banner/1 HTTP/1.1" 200 927 "-" "-" "-" "-" "-" -\n',
+]
+URL_TEMPLATES = [
+    "/api/v2/banner/{}",
+    "/api/v2/group/{}/banners",
+    "/api/1/photogenic_banners/list/?server_name=WIN7RB{}",
+    "/export/appinstall_raw/2017-06-{:02d}/",
+]
+BATCH_SIZE = 10000
+
+
+def generate_urls(urls_count):
+    """
+    Generate list of distinct urls
+    """
+    return [
+        URL_TEMPLATES[idx % len(URL_TEMPLATES)].format(idx)
+        for idx in range(urls_count)
+    ]
+
+
+def generate_log_lines(lines_count, urls_count=1000, errors_ratio=0.01,
+                       seed=0):
+    """
+    Generate lines of ui_short log. Url popularity follows Zipf's law,
+    request times are exponentially distributed and depend on url
+    :param errors_ratio: share of lines, which can't be parsed
+    :return: generator of lists of lines (batches)
+    """
+    rng = random.Random(seed)
+    urls = generate_urls(urls_count)
+    url_mean_times = [rng.uniform(0.01, 1.0) for _ in urls]
+    cum_weights = []
+    weights_sum = 0
+    for rank in range(1, urls_count + 1):
+        weights_sum += 1 / rank
+        cum_weights.append(weights_sum)
+
+    url_ids = range(urls_count)
+    while lines_count > 0:
+        batch_size = min(BATCH_SIZE, lines_count)
+        lines_count -= batch_size
+
+        batch = []
+        for url_id in rng.choices(url_ids, cum_weights=cum_weights,
+                                  k=batch_size):
+            if rng.random() < errors_ratio:
+                batch.append(rng.choice(ERROR_LINES))
+                continue
+
+            batch.append(LOG_LINE_TEMPLATE.format(
+                url=urls[url_id],
+                time=0.001 + rng.expovariate(1 / url_mean_times[url_id])
+            ))
+        yield batch
+
+
+def generate_log_file(log_path, lines_count, urls_count=1000,
+                      errors_ratio=0.01, seed=0):
+    """
+    Write synthetic ui_short log to log_path,
+    log is gzipped if log_path ends with .gz
+    :return: log_path
+    """
+    if log_path.endswith(".gz"):
+        log_file = gzip.open(log_path, "wt", encoding="UTF-8")
+    else:
+        log_file = open(log_path, "w", encoding="UTF-8")
+
+    with log_file as f:
+        for batch in generate_log_lines(lines_count, urls_count,
+                                        errors_ratio, seed):
+            f.write("".join(batch))
+
+    return log_path
+
+
+def get_log_name(log_date, gzipped=False):
+    """
+    Get name of log file, which is found by log_parser
+    """
+    log_name = log_date.strftime("nginx-access-ui.log-%Y%m%d")
+    return log_name + ".gz" if gzipped else log_name
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    help_msg = "path to log file, default - nginx-access-ui.log-{today}"
+    parser.add_argument("-o", "--output", type=str, help=help_msg)
+    help_msg = "count of lines in log"
+    parser.add_argument("-n", "--lines", type=int, default=1000000,
+                        help=help_msg)
+    help_msg = "count of distinct urls"
+    parser.add_argument("--urls", type=int, default=1000, help=help_msg)
+    help_msg = "share of lines, which can't be parsed"
+    parser.add_argument("--errors", type=float, default=0.01, help=help_msg)
+    help_msg = "gzip log file"
+    parser.add_argument("--gzip", action="store_true", help=help_msg)
+    help_msg = "seed of random generator"
+    parser.add_argument("--seed", type=int, default=0, help=help_msg)
+    args = parser.parse_args()
+
+    log_path = args.output or get_log_name(date.today())
+    if args.gzip and not log_path.endswith(".gz"):
+        log_path += ".gz"
+
+    generate_log_file(log_path, args.lines, args.urls, args.errors, args.seed)
+    print("Generated {} lines to {}".format(args.lines, log_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,385 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
 import os
 import re
 import gzip
+import pickle
+import subprocess
+import multiprocessing
+from contextlib import contextmanager
 from datetime import datetime
 
+from url_stats import LogStats
 
-def parse_log_file(log_path):
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+GZIP_DECOMPRESSORS = {
+    "python": None,
+    "gzip": ["gzip", "-dc"],
+    "zcat": ["zcat"],
+    "pigz": ["pigz", "-dc"],
+}
+
+
+def parse_log_file(log_path, log_stats=None, workers=1,
+                   gzip_decompressor="python"):
+    """
+    Parse log file and aggregate request times by url
+    :param log_stats: empty LogStats with aggregation settings
+    (exact median for all urls by default)
+    :param workers: count of processes for parsing uncompressed log
+    :param gzip_decompressor: "python" - gzip module, or name of external
+    program ("gzip", "zcat", "pigz"), which decompresses log in subprocess
+    :return: LogStats
+    """
+    if log_stats is None:
+        log_stats = LogStats()
+
+    if workers > 1 and not log_path.endswith(".gz"):
+        return parse_log_file_parallel(log_path, workers, log_stats)
+
+    with open_log_file(log_path, gzip_decompressor) as f:
+        parse_log_lines(read_buffered_lines(f), log_stats)
+
+    return log_stats
+
+
+@contextmanager
+def open_log_file(log_path, gzip_decompressor="python"):
     """
-    Parse log file and prepare dict for analyze
+    Open log file as binary stream. Gzipped log is decompressed
+    by gzip module or by external program in subprocess
     """
-    is_gzipped = log_path.endswith(".gz")
+    if gzip_decompressor not in GZIP_DECOMPRESSORS:
+        msg = "Unknown gzip decompressor: {}, available: {}"
+        raise ValueError(msg.format(
+            gzip_decompressor, ", ".join(GZIP_DECOMPRESSORS)
+        ))
 
-    if is_gzipped:
-        opener = gzip.open(log_path, "r")
+    if not log_path.endswith(".gz"):
+        with open(log_path, "rb") as f:
+            yield f
+    elif gzip_decompressor == "python":
+        with gzip.open(log_path, "rb") as f:
+            yield f
     else:
-        opener = open(log_path, "r", encoding="UTF-8")
+        command = GZIP_DECOMPRESSORS[gzip_decompressor] + [log_path]
+        with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+            yield process.stdout
+
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def read_buffered_lines(f, size=None):
+    """
+    Read binary stream by big buffers (until size bytes are read,
+    if size is set), decode every buffer once and split it into lines
+    """
+    tail = b""
 
-    log_urls = {"errors": 0, "urls_times": {}}
+    while size is None or size > 0:
+        read_size = READ_BUFFER_SIZE if size is None \
+            else min(READ_BUFFER_SIZE, size)
+        buffer = f.read(read_size)
+        if not buffer:
+            break
 
-    with opener:
-        for line in opener:
+        if size is not None:
+            size -= len(buffer)
 
-            if is_gzipped:
-                line = line.decode("UTF-8")
+        # Decode only complete lines, so multibyte symbols are not split
+        buffer = tail + buffer
+        lines_end = buffer.rfind(b"\n") + 1
+        tail = buffer[lines_end:]
+
+        lines = buffer[:lines_end].decode("UTF-8")
+        yield from io.StringIO(lines, newline="\n")
+
+    if tail:
+        yield tail.decode("UTF-8")
+
+
+def parse_log_file_parallel(log_path, workers, log_stats=None):
+    """
+    Split uncompressed log file into chunks, parse every chunk
+    in separate process and merge results
+    :return: LogStats
+    """
+    if log_stats is None:
+        log_stats = LogStats()
+
+    chunks = get_log_chunks(log_path, workers)
+    tasks = [
+        (log_path, start, end, log_stats.new_empty())
+        for start, end in chunks
+    ]
+
+    with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+        chunks_stats = pool.starmap(parse_log_chunk, tasks)
+
+    for chunk_stats in chunks_stats:
+        log_stats.merge(chunk_stats)
+
+    return log_stats
+
+
+def get_log_chunks(log_path, chunks_count):
+    """
+    Split file into chunks_count byte ranges, aligned to line boundaries
+    :return: list of (start, end) offsets
+    """
+    file_size = os.path.getsize(log_path)
+    bounds = [0]
 
-            line_parsed = parse_log_line(line)
+    with open(log_path, "rb") as f:
+        for idx in range(1, chunks_count):
+            offset = file_size * idx // chunks_count
+            if offset <= bounds[-1]:
+                continue
 
-            if line_parsed["is_error"]:
-                log_urls["errors"] += 1
-            else:
-                if line_parsed["url"] not in log_urls["urls_times"]:
-                    log_urls["urls_times"][line_parsed["url"]] = []
+            # Move to the beginning of the next line
+            f.seek(offset - 1)
+            f.readline()
+            offset = f.tell()
 
-                log_urls["urls_times"][line_parsed["url"]].append(
-                    line_parsed["request_time"]
-                )
+            if bounds[-1] < offset < file_size:
+                bounds.append(offset)
 
-    return log_urls
+    bounds.append(file_size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_log_chunk(log_path, start, end, log_stats):
+    """
+    Parse lines of uncompressed log file between start and end offsets
+    :return: LogStats
+    """
+    with open(log_path, "rb") as f:
+        f.seek(start)
+        parse_log_lines(read_buffered_lines(f, end - start), log_stats)
+
+    return log_stats
+
+
+def parse_log_file_incremental(log_path, state_path, log_stats=None,
+                               progress=None, on_previous_log=None):
+    """
+    Parse only lines of uncompressed log file, which were appended
+    since previous call. Byte offset and LogStats of already parsed
+    lines are stored in state_path file. State is rewritten on every call,
+    so with exact median (all request times of the log are kept) its size
+    grows with log file, reservoir median keeps it bounded
+    :param log_stats: empty LogStats with aggregation settings
+    :param progress: dict, where count of lines ("lines") and bytes
+    ("bytes") parsed by this call is saved
+    :param on_previous_log: function(log_path, log_stats), which is called,
+    when state belongs to other (previous) log file: lines appended to it
+    since previous call are parsed, so its stats are complete
+    :return: LogStats for the whole log file
+    """
+    if log_stats is None:
+        log_stats = LogStats()
+
+    log_file_stat = os.stat(log_path)
+    state = load_parse_state(state_path)
+
+    if state and state["log_path"] != log_path and on_previous_log \
+            and finish_log_parsing(state, log_stats):
+        on_previous_log(state["log_path"], state["log_stats"])
+
+    if not state \
+            or state["log_path"] != log_path \
+            or state["inode"] != log_file_stat.st_ino \
+            or state["offset"] > log_file_stat.st_size \
+            or state["log_stats"].settings() != log_stats.settings():
+        state = {
+            "log_path": log_path,
+            "inode": log_file_stat.st_ino,
+            "offset": 0,
+            "log_stats": log_stats,
+        }
+
+    start_offset = state["offset"]
+    start_rows_count = state["log_stats"].rows_count
+    with open(log_path, "rb") as f:
+        f.seek(state["offset"])
+        parse_log_lines(read_complete_lines(f), state["log_stats"])
+        state["offset"] = f.tell()
+
+    if progress is not None:
+        progress["lines"] = state["log_stats"].rows_count - start_rows_count
+        progress["bytes"] = state["offset"] - start_offset
+
+    save_parse_state(state_path, state)
+    return state["log_stats"]
+
+
+def finish_log_parsing(state, log_stats):
+    """
+    Parse lines of log file from state, which were appended since
+    the state was saved
+    :param log_stats: empty LogStats with aggregation settings
+    :return: True if log file is parsed, False if it was removed or
+    replaced, or state was aggregated with other settings
+    """
+    try:
+        log_file_stat = os.stat(state["log_path"])
+    except FileNotFoundError:
+        return False
+
+    if state["inode"] != log_file_stat.st_ino \
+            or state["offset"] > log_file_stat.st_size \
+            or state["log_stats"].settings() != log_stats.settings():
+        return False
+
+    with open(state["log_path"], "rb") as f:
+        f.seek(state["offset"])
+        parse_log_lines(read_complete_lines(f), state["log_stats"])
+        state["offset"] = f.tell()
+
+    return True
+
+
+def load_parse_state(state_path):
+    """
+    Load state of incremental parsing, return None if there is no state
+    """
+    try:
+        with open(state_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_parse_state(state_path, state):
+    """
+    Save state of incremental parsing, file is replaced atomically
+    """
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp_path, state_path)
+
+
+def get_daily_stats_path(log_date, stats_dir):
+    """
+    Get path to file with LogStats of log file for log_date
+    """
+    return os.path.join(
+        stats_dir, log_date.strftime("log_stats-%Y.%m.%d.pickle")
+    )
+
+
+def load_daily_stats(log_date, stats_dir, log_stats, log_size):
+    """
+    Load LogStats of log file for log_date, saved by save_daily_stats
+    :param log_stats: empty LogStats with aggregation settings
+    :param log_size: current size of log file
+    :return: LogStats or None, if there are no saved stats, they were
+    aggregated with other settings or log file has changed since then
+    """
+    state = load_parse_state(get_daily_stats_path(log_date, stats_dir))
+    if not isinstance(state, dict) \
+            or state["log_size"] != log_size \
+            or state["log_stats"].settings() != log_stats.settings():
+        return None
+
+    return state["log_stats"]
+
+
+def save_daily_stats(log_stats, log_date, stats_dir, log_size):
+    """
+    Save LogStats of log file for log_date to stats_dir
+    :param log_size: size of log file before parsing, stats aren't
+    reused if log file has changed
+    """
+    save_parse_state(
+        get_daily_stats_path(log_date, stats_dir),
+        {"log_stats": log_stats, "log_size": log_size}
+    )
+
+
+def read_complete_lines(f):
+    """
+    Read and decode lines from binary file. Stop before the last line,
+    if it is not complete yet: file position is left after the last
+    complete line
+    """
+    while True:
+        line = f.readline()
+        if not line.endswith(b"\n"):
+            f.seek(-len(line), os.SEEK_CUR)
+            break
+
+        yield line.decode("UTF-8")
+
+
+def parse_log_lines(lines, log_stats):
+    """
+    Parse lines and add them to log_stats
+    """
+    parse_line = LogLineParser().parse
+    add_url_time = log_stats.add
+
+    for line in lines:
+        line_parsed = parse_line(line)
+
+        if line_parsed is None:
+            log_stats.add_error()
+        else:
+            add_url_time(*line_parsed)
+
+
+class LogLineParser:
+    """
+    Parser of url and request time from ui_short log lines.
+    Well-formed lines are split with str methods, regex is used
+    only for lines, which don't match the fast path
+    """
+    regex = re.compile(r"\"[A-Z]+ ([^\s]+) .* (\d+\.\d+)\n")
+
+    def parse(self, line):
+        """
+        :return: tuple (url, request_time) or None for bad line
+        """
+        if not line.endswith("\n"):
+            return None
+
+        time_start = line.rfind(" ") + 1
+        quote = line.find("\"")
+        method_end = line.find(" ", quote)
+        url_end = line.find(" ", method_end + 1)
+
+        if 0 <= quote < method_end < url_end - 1 < time_start - 2:
+            method = line[quote + 1:method_end]
+            url = line[method_end + 1:url_end]
+            request_time = line[time_start:-1]
+            int_part, dot, frac_part = request_time.partition(".")
+
+            if method.isupper() and method.isalpha() and method.isascii() \
+                    and int_part.isdecimal() and frac_part.isdecimal() \
+                    and url.isprintable():
+                return self.make_result(url, request_time)
+
+        return self.parse_slow(line)
+
+    def parse_slow(self, line):
+        parsed_line = self.regex.search(line)
+        if not parsed_line:
+            return None
+
+        return self.make_result(*parsed_line.groups())
+
+    @staticmethod
+    def make_result(url, request_time):
+        request_time = float(request_time)
+        if not request_time:
+            return None
+
+        return url, request_time
 
 
 def parse_log_line(line):
@@ -47,17 +388,12 @@ def parse_log_line(line):
     """
     log_info = {"url": "", "is_error": True, "request_time": 0}
 
-    regex = re.compile(r"\"[A-Z]+ ([^\s]+) .* (\d+\.\d+)\n")
-    parsed_line = re.findall(regex, line)
-
-    if not parsed_line:
+    line_parsed = LogLineParser().parse(line)
+    if line_parsed is None:
         return log_info
 
-    log_info["url"] = parsed_line[0][0]
-    log_info["request_time"] = float(parsed_line[0][1])
-
-    if log_info["url"] and log_info["request_time"]:
-        log_info["is_error"] = False
+    log_info["url"], log_info["request_time"] = line_parsed
+    log_info["is_error"] = False
 
     return log_info
 
@@ -72,6 +408,26 @@ def get_newest_log_file(log_dir):
     return last_log
 
 
+def get_log_files(log_dir):
+    """
+    Get ui_log files in log_dir, sorted by date. Only one file is returned
+    for every date: if both uncompressed and gzipped logs exist,
+    uncompressed one is used (gzipped can be not completely written yet)
+    :return: list of dicts with date and filepath of log file
+    """
+    log_files_by_date = {}
+    for filename in sorted(os.listdir(log_dir), reverse=True):
+        log_date = get_log_file_date(filename)
+        if log_date:
+            log_files_by_date[log_date] = {
+                "date": log_date,
+                "filepath": os.path.join(log_dir, filename)
+            }
+
+    return [log_files_by_date[log_date]
+            for log_date in sorted(log_files_by_date)]
+
+
 def get_newest_file_from_list(fileslist, log_dir):
     last_log = {"date": None, "filepath": None}
     for filename in fileslist:
@@ -2,14 +2,22 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import argparse
+import cProfile
 import json
 import logging
-from datetime import datetime
+import resource
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import log_parser
 import log_analyzer
 import report_generator
+import url_normalizer
+import url_stats
 
 # log_format ui_short '$remote_addr $remote_user '
 #                     '$http_x_real_ip [$time_local] "$request" '
@@ -24,24 +32,50 @@ DEFAULT_CONFIG = {
     "LOG_DIR": "./log",
     "LOG_RESULT_DIR": "./log_result",
     "TS_DIR": "./",
-    "MAX_LOG_ERRORS_PERCENT": 25
+    "MAX_LOG_ERRORS_PERCENT": 25,
+    "MEDIAN_MODE": "exact",
+    "MEDIAN_RESERVOIR_SIZE": 1000,
+    "WORKERS": 1,
+    "INCREMENTAL": False,
+    "GZIP_DECOMPRESSOR": "python",
+    "URL_STRIP_QUERY": False,
+    "URL_COLLAPSE_NUMBERS": False,
+    "URL_RULES": [],
+    "MAX_URLS": 0,
+    "SAVE_REPORT_STATS": False,
+    "AGGREGATES_DIR": "",
+    "REPORT_PERCENTILES": [],
+    "PERCENTILE_ACCURACY": 0.01
 }
 DEFAULT_CONFIG_PATH = "./config.json"
+STATE_FILE_NAME = "log_analyzer.state"
 
 
-def get_config_path_from_args(default_config_path):
+def get_args():
     """
     Setup args for command line, read args
-    :param default_config_path: path to default config file
-    :return: path to config file
+    :return: parsed args
     """
     parser = argparse.ArgumentParser()
     help_msg = "path to config file, example: /home/me/config.json"
     parser.add_argument("-c", "--config", type=str, help=help_msg)
+    help_msg = "count of processes for parsing uncompressed log file"
+    parser.add_argument("-w", "--workers", type=int, help=help_msg)
+    help_msg = "build reports for all log files without reports"
+    parser.add_argument("--backfill", action="store_true", help=help_msg)
+    help_msg = "build report for N last days of logs"
+    parser.add_argument("--days", type=int, help=help_msg)
+    help_msg = "log time of every stage, parsing throughput and peak memory"
+    parser.add_argument("--timings", action="store_true", help=help_msg)
+    help_msg = "path to file for cProfile stats of log parsing"
+    parser.add_argument("--profile", type=str, help=help_msg)
     args = parser.parse_args()
 
-    config_path = args.config if args.config else default_config_path
-    return config_path
+    if (args.timings or args.profile) and (args.backfill or args.days):
+        parser.error("--timings and --profile can't be used with "
+                     "--backfill or --days")
+
+    return args
 
 
 def parse_config(path, default_config):
@@ -101,68 +135,453 @@ def update_ts(ts_dir):
     os.utime(ts_path, times=(timestamp, timestamp))
 
 
+def create_log_stats(config):
+    """
+    Create empty LogStats with aggregation settings from config
+    """
+    normalizer = url_normalizer.UrlNormalizer(
+        config["URL_STRIP_QUERY"],
+        config["URL_COLLAPSE_NUMBERS"],
+        config["URL_RULES"]
+    )
+    return url_stats.LogStats(
+        config["MEDIAN_MODE"],
+        config["MEDIAN_RESERVOIR_SIZE"],
+        config["MAX_URLS"],
+        normalizer,
+        config["REPORT_PERCENTILES"],
+        config["PERCENTILE_ACCURACY"]
+    )
+
+
+class PerfStats:
+    """
+    Execution time of every stage and volume of parsed data
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.lines_count = 0
+        self.bytes_count = 0
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Add execution time of code block to stage time
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0) + elapsed
+
+    def log(self):
+        """
+        Log time of every stage, parsing throughput and peak RSS
+        """
+        log_msg = "Timings: {}".format(", ".join(
+            "{} {:.3f} s".format(name, seconds)
+            for name, seconds in self.timings.items()
+        ))
+        logging.info(log_msg)
+
+        parse_time = self.timings.get("parse")
+        if parse_time:
+            log_msg = "Parse throughput: {:.0f} lines/sec, {:.2f} MB/sec"
+            logging.info(log_msg.format(
+                self.lines_count / parse_time,
+                self.bytes_count / parse_time / 2 ** 20
+            ))
+
+        # ru_maxrss is in kilobytes on Linux, for children it is peak RSS
+        # of the largest finished child process (like parsing worker)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children_peak_rss = resource.getrusage(
+            resource.RUSAGE_CHILDREN
+        ).ru_maxrss
+        log_msg = "Peak RSS: {:.1f} MB, of child processes: {:.1f} MB"
+        logging.info(log_msg.format(
+            peak_rss / 2 ** 10, children_peak_rss / 2 ** 10
+        ))
+
+
+@contextmanager
+def profile_to(profile_path):
+    """
+    Profile code block with cProfile and dump stats to profile_path.
+    Does nothing if profile_path is not set
+    """
+    if not profile_path:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+def log_skipped_parsing(args, perf_stats):
+    """
+    Log timings of discovery stage and that profile isn't saved,
+    if log isn't parsed
+    """
+    if args.profile:
+        logging.info("Log isn't parsed, profile isn't saved")
+    if args.timings:
+        perf_stats.log()
+
+
+def finish_previous_log(log_path, log_stats, config):
+    """
+    Rebuild report for log file, which was parsed incrementally, when
+    newer log file appears: lines appended to it after the last run
+    are in log_stats. Its complete stats are saved to AGGREGATES_DIR
+    :return: path to report file or None, if log file is empty
+    """
+    log_date = log_parser.get_log_file_date(os.path.basename(log_path))
+    if config["AGGREGATES_DIR"]:
+        log_parser.save_daily_stats(
+            log_stats, log_date, config["AGGREGATES_DIR"],
+            os.path.getsize(log_path)
+        )
+
+    if not log_analyzer.calc_log_rows_count(log_stats):
+        return None
+
+    report_list = log_analyzer.analyze_log(
+        log_stats, config["MAX_LOG_ERRORS_PERCENT"], config["REPORT_SIZE"]
+    )
+    report_path = report_generator.save_report_html(
+        report_list, log_date, config["REPORT_DIR"]
+    )
+    if config["SAVE_REPORT_STATS"]:
+        report_generator.save_report_stats(
+            report_list, log_date, config["REPORT_DIR"]
+        )
+
+    log_msg = "Previous log file ({log_path}) parsed to the end. " \
+              "Rebuilt report file - {report_path}"
+    logging.info(log_msg.format(log_path=log_path, report_path=report_path))
+    return report_path
+
+
+def build_report(log_file_info, config, incremental=False,
+                 perf_stats=None, profile_path=None):
+    """
+    Parse log file, analyze it and save report
+    :param log_file_info: dict with date and filepath of log file
+    :param incremental: parse only new lines of log file,
+    which is still being written
+    :param perf_stats: PerfStats, where execution time of stages is saved
+    :param profile_path: path to file for cProfile stats of log parsing
+    :return: path to report file or None, if log file is empty
+    """
+    if perf_stats is None:
+        perf_stats = PerfStats()
+    log_size = os.path.getsize(log_file_info["filepath"])
+
+    # 1. Parse log
+    with perf_stats.stage("parse"), profile_to(profile_path):
+        if incremental:
+            progress = {}
+            log_stats = log_parser.parse_log_file_incremental(
+                log_file_info["filepath"],
+                os.path.join(config["TS_DIR"], STATE_FILE_NAME),
+                create_log_stats(config),
+                progress,
+                partial(finish_previous_log, config=config)
+            )
+        else:
+            log_stats = log_parser.parse_log_file(
+                log_file_info["filepath"],
+                create_log_stats(config),
+                config["WORKERS"],
+                config["GZIP_DECOMPRESSOR"]
+            )
+
+    # Throughput is measured by lines and bytes parsed in this run
+    if incremental:
+        perf_stats.lines_count = progress["lines"]
+        perf_stats.bytes_count = progress["bytes"]
+    else:
+        perf_stats.lines_count = log_analyzer.calc_log_rows_count(log_stats)
+        perf_stats.bytes_count = log_size
+
+    # Stats of log file, which is still being written, are not complete
+    if config["AGGREGATES_DIR"] and not incremental:
+        log_parser.save_daily_stats(
+            log_stats, log_file_info["date"], config["AGGREGATES_DIR"],
+            log_size
+        )
+
+    if not log_analyzer.calc_log_rows_count(log_stats):
+        log_msg = "Log file ({}) is empty"
+        logging.info(log_msg.format(
+            log_file_info["filepath"])
+        )
+        return None
+
+    log_msg = "Parsed {lines} lines, {urls} urls from log file"
+    logging.info(log_msg.format(
+        lines=log_analyzer.calc_log_rows_count(log_stats),
+        urls=len(log_stats.urls)
+    ))
+
+    # 2. Analyze log
+    with perf_stats.stage("analyze"):
+        report_list = log_analyzer.analyze_log(
+            log_stats, config["MAX_LOG_ERRORS_PERCENT"], config["REPORT_SIZE"]
+        )
+    log_msg = "Log has been analyzed"
+    logging.info(log_msg)
+
+    # 3. Generate report
+    with perf_stats.stage("render"):
+        report_path = report_generator.save_report_html(
+            report_list, log_file_info["date"], config["REPORT_DIR"]
+        )
+        if config["SAVE_REPORT_STATS"]:
+            report_generator.save_report_stats(
+                report_list, log_file_info["date"], config["REPORT_DIR"]
+            )
+
+    log_msg = "Log file ({log_path}) parsed succesfully. " \
+              "Created report file - {report_path}"
+    logging.info(log_msg.format(
+        log_path=log_file_info["filepath"],
+        report_path=report_path
+    ))
+    return report_path
+
+
+def backfill_reports(config):
+    """
+    Build reports for all log files in LOG_DIR, which don't have reports
+    (one log file for every date, see log_parser.get_log_files).
+    Log files are processed in parallel by WORKERS processes
+    """
+    report_dates = report_generator.get_report_dates(config["REPORT_DIR"])
+    log_files = [
+        log_file_info
+        for log_file_info in log_parser.get_log_files(config["LOG_DIR"])
+        if log_file_info["date"] not in report_dates
+    ]
+    if not log_files:
+        log_msg = "Reports for all log files in dir {} already exist"
+        logging.info(log_msg.format(config["LOG_DIR"]))
+        return
+
+    log_msg = "Building reports for {} log files"
+    logging.info(log_msg.format(len(log_files)))
+
+    # Every log file is parsed by single process of the pool
+    worker_config = dict(config, WORKERS=1)
+    failed_log_files = []
+
+    with ProcessPoolExecutor(max_workers=config["WORKERS"]) as executor:
+        futures = {
+            executor.submit(build_report, log_file_info, worker_config):
+                log_file_info
+            for log_file_info in log_files
+        }
+        for future in as_completed(futures):
+            log_file_info = futures[future]
+            try:
+                future.result()
+            except Exception as ex:
+                msg = "Report for log file ({0}) failed. {1}: {2}"
+                logging.error(msg.format(
+                    log_file_info["filepath"], type(ex).__name__, ex
+                ))
+                failed_log_files.append(log_file_info["filepath"])
+
+    update_ts(config["TS_DIR"])
+
+    if failed_log_files:
+        msg = "Failed to build reports for log files: {}"
+        raise Exception(msg.format(", ".join(sorted(failed_log_files))))
+
+
+def is_incremental(log_file_info, config):
+    """
+    Log file, which is still being written, is parsed incrementally
+    and its report is rebuilt on every run
+    """
+    return config["INCREMENTAL"] and \
+        not log_file_info["filepath"].endswith(".gz")
+
+
+def get_daily_stats(log_file_info, config, incremental=False):
+    """
+    Load saved LogStats of log file or parse log file, if there are
+    no saved stats or log file has changed since they were saved.
+    Parsed stats are saved to AGGREGATES_DIR
+    :param incremental: parse only new lines of log file, which is
+    still being written, its stats are not saved to AGGREGATES_DIR
+    :return: LogStats
+    """
+    log_stats = create_log_stats(config)
+    if incremental:
+        return log_parser.parse_log_file_incremental(
+            log_file_info["filepath"],
+            os.path.join(config["TS_DIR"], STATE_FILE_NAME),
+            log_stats,
+            on_previous_log=partial(finish_previous_log, config=config)
+        )
+
+    log_size = os.path.getsize(log_file_info["filepath"])
+    if config["AGGREGATES_DIR"]:
+        daily_stats = log_parser.load_daily_stats(
+            log_file_info["date"], config["AGGREGATES_DIR"], log_stats,
+            log_size
+        )
+        if daily_stats:
+            return daily_stats
+
+    log_msg = "No actual saved stats for log file ({}), parsing it"
+    logging.info(log_msg.format(log_file_info["filepath"]))
+
+    log_stats = log_parser.parse_log_file(
+        log_file_info["filepath"],
+        log_stats,
+        config["WORKERS"],
+        config["GZIP_DECOMPRESSOR"]
+    )
+    if config["AGGREGATES_DIR"]:
+        log_parser.save_daily_stats(
+            log_stats, log_file_info["date"], config["AGGREGATES_DIR"],
+            log_size
+        )
+
+    return log_stats
+
+
+def build_rolling_report(config, days):
+    """
+    Merge stats of log files for last days (ending with date
+    of newest log file) and save report for all of them
+    :return: path to report file or None, if there are no log files
+    """
+    log_files = log_parser.get_log_files(config["LOG_DIR"])
+    if not log_files:
+        log_msg = "No log file found in dir {}"
+        logging.info(log_msg.format(config["LOG_DIR"]))
+        return None
+
+    last_date = log_files[-1]["date"]
+    first_date = last_date - timedelta(days=days - 1)
+    log_files_by_date = {
+        log_file_info["date"]: log_file_info
+        for log_file_info in log_files
+        if log_file_info["date"] >= first_date
+    }
+
+    log_stats = create_log_stats(config)
+    for log_date in sorted(log_files_by_date):
+        log_stats.merge(get_daily_stats(
+            log_files_by_date[log_date], config,
+            log_date == last_date and is_incremental(
+                log_files_by_date[log_date], config
+            )
+        ))
+
+    if not log_analyzer.calc_log_rows_count(log_stats):
+        log_msg = "Log files from {} to {} are empty"
+        logging.info(log_msg.format(first_date, last_date))
+        return None
+
+    report_list = log_analyzer.analyze_log(
+        log_stats, config["MAX_LOG_ERRORS_PERCENT"], config["REPORT_SIZE"]
+    )
+    report_path = report_generator.save_report_html(
+        report_list, last_date, config["REPORT_DIR"], days=days
+    )
+    if config["SAVE_REPORT_STATS"]:
+        report_generator.save_report_stats(
+            report_list, last_date, config["REPORT_DIR"], days
+        )
+
+    log_msg = "{count} log files from {first} to {last} merged. " \
+              "Created report file - {report_path}"
+    logging.info(log_msg.format(
+        count=len(log_files_by_date),
+        first=first_date,
+        last=last_date,
+        report_path=report_path
+    ))
+    return report_path
+
+
 def main():
     try:
         # 1. Prepare
         set_logging(None)
 
-        config_path = get_config_path_from_args(DEFAULT_CONFIG_PATH)
+        args = get_args()
+        config_path = args.config if args.config else DEFAULT_CONFIG_PATH
         config = parse_config(config_path, DEFAULT_CONFIG)
+        if args.workers:
+            config["WORKERS"] = args.workers
 
         set_logging(config["LOG_RESULT_DIR"])
 
-        # 2. Parse log
-        last_log_file_info = log_parser.get_newest_log_file(config["LOG_DIR"])
+        if args.backfill:
+            backfill_reports(config)
+            return
+
+        if args.days:
+            if build_rolling_report(config, args.days):
+                update_ts(config["TS_DIR"])
+            return
+
+        # 2. Find log
+        perf_stats = PerfStats()
+        with perf_stats.stage("discovery"):
+            last_log_file_info = log_parser.get_newest_log_file(
+                config["LOG_DIR"]
+            )
         if not last_log_file_info["filepath"]:
             log_msg = "No log file found in dir {}"
             logging.info(log_msg.format(
                 config["LOG_DIR"])
             )
+            log_skipped_parsing(args, perf_stats)
             return
 
-        if report_generator.report_by_date_exists(
+        incremental = is_incremental(last_log_file_info, config)
+        if incremental and config["MEDIAN_MODE"] == "exact":
+            log_msg = "Incremental parsing with exact median saves all " \
+                      "request times of log file on every run, " \
+                      "use reservoir median mode to keep state bounded"
+            logging.warning(log_msg)
+
+        with perf_stats.stage("discovery"):
+            report_exists = report_generator.report_by_date_exists(
                 last_log_file_info["date"], config["REPORT_DIR"]
-        ):
+            ) if not incremental else False
+
+        if report_exists:
             log_msg = "Report for {} already exists"
             logging.info(log_msg.format(
                 last_log_file_info["date"])
             )
+            log_skipped_parsing(args, perf_stats)
             return
 
-        log_urls = log_parser.parse_log_file(last_log_file_info["filepath"])
-        if not log_urls:
-            log_msg = "Log file ({}) is empty"
-            logging.info(log_msg.format(
-                last_log_file_info["filepath"])
-            )
-            return
-
-        log_msg = "Parsed {lines} lines, {urls} urls from log file"
-        logging.info(log_msg.format(
-            lines=log_analyzer.calc_log_rows_count(log_urls),
-            urls=len(log_urls["urls_times"])
-        ))
-
-        # 3. Analyze log
-        report_list = log_analyzer.analyze_log(
-            log_urls, config["MAX_LOG_ERRORS_PERCENT"], config["REPORT_SIZE"]
+        # 3. Build report
+        report_path = build_report(
+            last_log_file_info, config, incremental, perf_stats, args.profile
         )
-        log_msg = "Log has been analyzed"
-        logging.info(log_msg)
+        if report_path:
+            update_ts(config["TS_DIR"])
 
-        # 4. Generate report
-        report_path = report_generator.save_report_html(
-            report_list, last_log_file_info["date"], config["REPORT_DIR"]
-        )
-
-        update_ts(config["TS_DIR"])
-
-        log_msg = "Log file ({log_path}) parsed succesfully. " \
-                  "Created report file - {report_path}"
-        logging.info(log_msg.format(
-            log_path=last_log_file_info["filepath"],
-            report_path=report_path
-        ))
+        if args.timings:
+            perf_stats.log()
     except Exception as ex:
         msg = "{0}: {1}".format(type(ex).__name__, ex)
         logging.exception(msg, exc_info=True)
@@ -1,49 +1,230 @@
 import os
 import re
+import sys
 import json
+import mmap
+import struct
+from array import array
 from datetime import datetime
+from functools import lru_cache
 
+TEMPLATE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "report.html"
+)
+TABLE_PLACEHOLDER = "$table_json"
+STATS_MAGIC = b"LASTATS1"
+STATS_HEADER = struct.Struct("<8sQQ")
+STATS_COLUMN = struct.Struct("<16sc7x")
+REPORT_NAME_REGEX = re.compile(r"report-(\d{4}\.\d{2}\.\d{2})\.html")
 
-def save_report_html(report_list, report_date, report_dir):
+
+def save_report_html(report_list, report_date, report_dir,
+                     template_path=TEMPLATE_PATH, days=1):
     """
-    Prepare and save report file in report_dir
+    Prepare and save report file in report_dir.
+    Report is written to temporary file, which replaces report file
+    only when it is complete
+    :param days: count of days, aggregated in report
     """
-    report_name = report_date.strftime("report-%Y.%m.%d.html")
+    report_name = get_report_name(report_date, "html", days)
     report_path = os.path.join(report_dir, report_name)
+    tmp_path = os.path.splitext(report_path)[0] + ".tmp"
+
+    template_head, template_tail = load_report_template(template_path)
+
+    try:
+        with open(tmp_path, "w", encoding="UTF-8") as f:
+            f.write(template_head)
+            write_table_json(f, report_list)
+            f.write(template_tail)
+
+        os.replace(tmp_path, report_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return report_path
+
+
+def get_report_name(report_date, extension, days=1):
+    """
+    Get report filename. Report for several days ending with report_date
+    has days count in its name, e.g. report-2017.06.30-7days.html
+    """
+    report_name = report_date.strftime("report-%Y.%m.%d")
+    if days > 1:
+        report_name += "-{}days".format(days)
+
+    return "{}.{}".format(report_name, extension)
+
 
-    with open("report.html", encoding="UTF-8") as f:
+@lru_cache(maxsize=None)
+def load_report_template(template_path):
+    """
+    Read report template and split it by table placeholder
+    :return: tuple (template part before table, template part after table)
+    """
+    with open(template_path, encoding="UTF-8") as f:
         report_template = f.read()
 
-    table_json = json.dumps(report_list)
-    report_template = report_template.replace("$table_json", table_json)
+    template_head, placeholder, template_tail = report_template.partition(
+        TABLE_PLACEHOLDER
+    )
+    if not placeholder:
+        msg = "Placeholder {} not found in report template {}"
+        raise ValueError(msg.format(TABLE_PLACEHOLDER, template_path))
+
+    return template_head, template_tail
+
+
+def write_table_json(f, report_list):
+    """
+    Write report_list to file as JSON array row by row
+    """
+    f.write("[")
+    for idx, url_info in enumerate(report_list):
+        if idx:
+            f.write(", ")
+        f.write(json.dumps(url_info))
+    f.write("]")
+
+
+def save_report_stats(report_list, report_date, report_dir, days=1):
+    """
+    Save report as columnar binary file near html report.
+    File format (all numbers are little-endian, 8 bytes wide):
+    header (magic, rows count, columns count), column descriptors
+    (name, array typecode), column values, offsets of urls (rows + 1)
+    and utf-8 urls. Row index is used as url id
+    """
+    report_name = get_report_name(report_date, "stats", days)
+    report_path = os.path.join(report_dir, report_name)
+    tmp_path = report_path + ".tmp"
+
+    columns = [
+        (name, "q" if name == "count" else "d")
+        for name in (report_list[0] if report_list else [])
+        if name != "url"
+    ]
+    urls = [url_info["url"].encode("UTF-8") for url_info in report_list]
+    url_offsets = array("q", [0])
+    for url in urls:
+        url_offsets.append(url_offsets[-1] + len(url))
+
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(STATS_HEADER.pack(
+                STATS_MAGIC, len(report_list), len(columns)
+            ))
+            for name, typecode in columns:
+                f.write(STATS_COLUMN.pack(name.encode(), typecode.encode()))
+
+            for name, typecode in columns:
+                write_stats_column(f, array(
+                    typecode, (url_info[name] for url_info in report_list)
+                ))
+            write_stats_column(f, url_offsets)
+            f.write(b"".join(urls))
 
-    with open(report_path, "w", encoding="UTF-8") as f:
-        f.write(report_template)
+        os.replace(tmp_path, report_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
     return report_path
 
 
+def write_stats_column(f, values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    values.tofile(f)
+
+
+def load_report_stats(stats_path):
+    """
+    Memory-map columnar report file, saved by save_report_stats
+    :return: dict {column name: memoryview of column values},
+    urls are returned as list in "url" item
+    """
+    with open(stats_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, rows_count, columns_count = STATS_HEADER.unpack_from(data)
+    if magic != STATS_MAGIC:
+        raise ValueError("Bad report stats file: {}".format(stats_path))
+
+    offset = STATS_HEADER.size
+    columns = []
+    for _ in range(columns_count):
+        name, typecode = STATS_COLUMN.unpack_from(data, offset)
+        columns.append((name.rstrip(b"\0").decode(), typecode.decode()))
+        offset += STATS_COLUMN.size
+
+    view = memoryview(data)
+    report_stats = {}
+    for name, typecode in columns + [("url_offsets", "q")]:
+        column_size = 8 * (rows_count + 1 if name == "url_offsets"
+                           else rows_count)
+        report_stats[name] = read_stats_column(
+            view[offset:offset + column_size], typecode
+        )
+        offset += column_size
+
+    url_offsets = report_stats.pop("url_offsets")
+    report_stats["url"] = [
+        bytes(view[offset + start:offset + end]).decode("UTF-8")
+        for start, end in zip(url_offsets[:-1], url_offsets[1:])
+    ]
+
+    return report_stats
+
+
+def read_stats_column(view, typecode):
+    column = view.cast(typecode)
+    if sys.byteorder == "big":
+        column = array(typecode, column)
+        column.byteswap()
+    return column
+
+
 def report_by_date_exists(log_date, report_dir):
     """
     Check if report for log_date exist in report_dir
     """
+    return log_date in get_report_dates(report_dir)
+
+
+def get_report_dates(report_dir):
+    """
+    Get set of dates, for which reports exist in report_dir
+    """
+    report_dates = set()
 
     for filename in os.listdir(report_dir):
-        if compare_report_date_with_log_date(filename, log_date):
-            return True
+        report_date = get_report_date(filename)
+        if report_date:
+            report_dates.add(report_date)
 
-    return False
+    return report_dates
 
 
 def compare_report_date_with_log_date(filename, log_date):
     """
     Check if date from report filename and log_date are equal
     """
+    return log_date == get_report_date(filename)
+
+
+def get_report_date(filename):
+    """
+    Get date from report filename
+    """
     report_date = None
 
-    regex = re.compile(r"report-(\d{4}\.\d{2}\.\d{2})\.html")
-    report_date_str = re.findall(regex, filename)
+    report_date_str = re.findall(REPORT_NAME_REGEX, filename)
     if report_date_str:
         report_date = datetime.strptime(report_date_str[0], "%Y.%m.%d").date()
 
-    return log_date == report_date
+    return report_date
@@ -1,7 +1,20 @@
+import os
+import gzip
+import pstats
+import json
+import tempfile
 import unittest
+from unittest import mock
 from datetime import date
+from statistics import median
 
+import main
 import log_parser
+import log_analyzer
+import log_generator
+import report_generator
+import url_normalizer
+import url_stats
 
 
 class TestGetLogFileDate(unittest.TestCase):
@@ -46,6 +59,94 @@ class TestGetLogFileDate(unittest.TestCase):
         self.assertEqual(log_date, None)
 
 
+class TestLogAndReportFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        filenames = [
+            "nginx-access-ui.log-20180305.gz",
+            "nginx-access-ui.log-20180303",
+            "nginx-access-ui.log-20180304",
+            "nginx-access-ui.log-20180304.gz",
+            "report-2018.03.04.html",
+            "bad-filename-format-20180305",
+        ]
+        for filename in filenames:
+            open(os.path.join(self.tmp_dir.name, filename), "w").close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_log_files(self):
+        log_files = log_parser.get_log_files(self.tmp_dir.name)
+        self.assertEqual(
+            [log_file["date"] for log_file in log_files],
+            [date(2018, 3, 3), date(2018, 3, 4), date(2018, 3, 5)]
+        )
+        # only uncompressed log is used, if there is gzipped one too
+        self.assertEqual(
+            os.path.basename(log_files[1]["filepath"]),
+            "nginx-access-ui.log-20180304"
+        )
+
+    def test_get_report_dates(self):
+        report_dates = report_generator.get_report_dates(self.tmp_dir.name)
+        self.assertEqual(report_dates, {date(2018, 3, 4)})
+
+
+class TestSaveReportHtml(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_report(self):
+        report_list = [
+            {"url": "/api/1/", "count": 2, "time_sum": 0.5},
+            {"url": "/api/2/", "count": 1, "time_sum": 0.1},
+        ]
+        report_path = report_generator.save_report_html(
+            report_list, date(2018, 3, 4), self.tmp_dir.name
+        )
+
+        self.assertEqual(os.listdir(self.tmp_dir.name), [
+            "report-2018.03.04.html"
+        ])
+        with open(report_generator.TEMPLATE_PATH, encoding="UTF-8") as f:
+            report_html = f.read().replace(
+                "$table_json", json.dumps(report_list)
+            )
+        with open(report_path, encoding="UTF-8") as f:
+            self.assertEqual(f.read(), report_html)
+
+    def test_save_and_load_report_stats(self):
+        report_list = [
+            {"url": "/api/1/", "count": 2, "time_sum": 0.5, "time_med": 0.2},
+            {"url": "/апи/2/", "count": 1, "time_sum": 0.1, "time_med": 0.1},
+        ]
+        stats_path = report_generator.save_report_stats(
+            report_list, date(2018, 3, 4), self.tmp_dir.name
+        )
+        report_stats = report_generator.load_report_stats(stats_path)
+
+        self.assertEqual(report_stats["url"], ["/api/1/", "/апи/2/"])
+        self.assertEqual(list(report_stats["count"]), [2, 1])
+        self.assertEqual(list(report_stats["time_sum"]), [0.5, 0.1])
+        self.assertEqual(list(report_stats["time_med"]), [0.2, 0.1])
+
+    def test_report_name_for_several_days(self):
+        report_generator.save_report_html(
+            [], date(2018, 3, 4), self.tmp_dir.name, days=7
+        )
+
+        self.assertEqual(os.listdir(self.tmp_dir.name), [
+            "report-2018.03.04-7days.html"
+        ])
+        self.assertEqual(
+            report_generator.get_report_dates(self.tmp_dir.name), set()
+        )
+
+
 class TestParseLogLine(unittest.TestCase):
     def test_empty_line(self):
         log_line = ""
@@ -65,5 +166,551 @@ class TestParseLogLine(unittest.TestCase):
         self.assertEqual(log_info_res, log_info_good)
 
 
+class TestLogLineParser(unittest.TestCase):
+    def setUp(self):
+        self.parser = log_parser.LogLineParser()
+
+    def test_good_line(self):
+        log_line = '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] ' \
+                   '"GET /api/v2/group/1769230/banners HTTP/1.1" 200 1020 ' \
+                   '"-" "Configovod" "-" ' \
+                   '"1498697422-2118016444-4708-9752747" "712e90144abee9" ' \
+                   '0.628\n'
+        self.assertEqual(
+            self.parser.parse(log_line),
+            ("/api/v2/group/1769230/banners", 0.628)
+        )
+
+    def test_regex_fallback(self):
+        log_line = '1.169.137.128 "- [29/Jun/2017:03:50:22 +0300] ' \
+                   '"GET /api/v2/slot/4705/groups HTTP/1.1" 200 2613 ' \
+                   '"-" "-" "-" "-" "-" 0.704\n'
+        self.assertEqual(
+            self.parser.parse(log_line), ("/api/v2/slot/4705/groups", 0.704)
+        )
+
+    def test_zero_time(self):
+        log_line = '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] ' \
+                   '"GET /api/v2/slot/4705/groups HTTP/1.1" 200 2613 ' \
+                   '"-" "-" "-" "-" "-" 0.000\n'
+        self.assertIsNone(self.parser.parse(log_line))
+
+    def test_bad_time(self):
+        log_line = '1.169.137.128 -  - [29/Jun/2017:03:50:22 +0300] ' \
+                   '"GET /api/v2/slot/4705/groups HTTP/1.1" 200 2613 ' \
+                   '"-" "-" "-" "-" "-" 0.7a4\n'
+        self.assertIsNone(self.parser.parse(log_line))
+
+
+class TestParseLogFileParallel(unittest.TestCase):
+    log_line = '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] ' \
+               '"GET /api/v2/banner/{} HTTP/1.1" 200 927 "-" ' \
+               '"Lynx/2.8.8dev.9 libwww-FM/2.14" "-" ' \
+               '"1498697422-2190034393-4708-9752759" "dc7161be3" {}\n'
+
+    def setUp(self):
+        fd, self.log_path = tempfile.mkstemp()
+        with os.fdopen(fd, "w", encoding="UTF-8") as f:
+            for i in range(100):
+                f.write(self.log_line.format(i % 7, "0.{:03d}".format(i + 1)))
+            f.write("broken line\n")
+
+    def tearDown(self):
+        os.remove(self.log_path)
+
+    def test_chunks_aligned_to_lines(self):
+        chunks = log_parser.get_log_chunks(self.log_path, 4)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[-1][1], os.path.getsize(self.log_path))
+
+        with open(self.log_path, "rb") as f:
+            for start, end in chunks[1:]:
+                f.seek(start - 1)
+                self.assertEqual(f.read(1), b"\n")
+
+    def test_same_result_as_serial(self):
+        serial = log_parser.parse_log_file(self.log_path)
+        parallel = log_parser.parse_log_file(self.log_path, workers=3)
+
+        self.assertEqual(parallel.errors, serial.errors)
+        self.assertEqual(set(parallel.urls), set(serial.urls))
+        for url, serial_stats in serial.urls.items():
+            self.assertEqual(parallel.urls[url].count, serial_stats.count)
+            self.assertAlmostEqual(
+                parallel.urls[url].time_sum, serial_stats.time_sum
+            )
+            self.assertEqual(
+                parallel.urls[url].median(), serial_stats.median()
+            )
+
+
+class TestParseGzippedLogFile(unittest.TestCase):
+    log_line = TestParseLogFileParallel.log_line
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmp_dir.name, "log.gz")
+        with gzip.open(self.log_path, "wt", encoding="UTF-8") as f:
+            for i in range(50):
+                f.write(self.log_line.format("ы" * i, "0.{:03d}".format(i + 1)))
+            f.write("broken line\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_decompressors(self):
+        for gzip_decompressor in ("python", "gzip"):
+            log_stats = log_parser.parse_log_file(
+                self.log_path, gzip_decompressor=gzip_decompressor
+            )
+            self.assertEqual(log_stats.errors, 1)
+            self.assertEqual(len(log_stats.urls), 50)
+
+    def test_small_buffers(self):
+        with gzip.open(self.log_path, "rb") as f:
+            lines = f.read().decode("UTF-8").splitlines(keepends=True)
+
+        with mock.patch("log_parser.READ_BUFFER_SIZE", 7):
+            with log_parser.open_log_file(self.log_path) as f:
+                self.assertEqual(
+                    list(log_parser.read_buffered_lines(f)), lines
+                )
+
+
+class TestParseLogFileIncremental(unittest.TestCase):
+    log_line = TestParseLogFileParallel.log_line
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmp_dir.name, "log")
+        self.state_path = os.path.join(self.tmp_dir.name, "state")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def append_to_log(self, text):
+        with open(self.log_path, "a", encoding="UTF-8") as f:
+            f.write(text)
+
+    def test_parse_only_new_lines(self):
+        first_line = self.log_line.format(1, "0.100")
+        second_line = self.log_line.format(1, "0.300")
+
+        self.append_to_log(first_line + second_line[:20])
+        log_stats = log_parser.parse_log_file_incremental(
+            self.log_path, self.state_path
+        )
+        self.assertEqual(log_stats.rows_count, 1)
+
+        self.append_to_log(second_line[20:])
+        log_stats = log_parser.parse_log_file_incremental(
+            self.log_path, self.state_path
+        )
+        self.assertEqual(log_stats.rows_count, 2)
+        self.assertEqual(log_stats.errors, 0)
+        self.assertAlmostEqual(log_stats.urls["/api/v2/banner/1"].median(), 0.2)
+
+    def test_progress_of_new_lines(self):
+        self.append_to_log(self.log_line.format(1, "0.100") * 3)
+        log_parser.parse_log_file_incremental(self.log_path, self.state_path)
+
+        new_lines = self.log_line.format(2, "0.100") * 2
+        self.append_to_log(new_lines)
+        progress = {}
+        log_stats = log_parser.parse_log_file_incremental(
+            self.log_path, self.state_path, progress=progress
+        )
+        self.assertEqual(log_stats.rows_count, 5)
+        self.assertEqual(progress, {"lines": 2, "bytes": len(new_lines)})
+
+    def test_finish_previous_log(self):
+        self.append_to_log(self.log_line.format(1, "0.100") * 2)
+        log_parser.parse_log_file_incremental(self.log_path, self.state_path)
+        self.append_to_log(self.log_line.format(1, "0.100"))
+
+        new_log_path = os.path.join(self.tmp_dir.name, "new_log")
+        with open(new_log_path, "w", encoding="UTF-8") as f:
+            f.write(self.log_line.format(2, "0.100"))
+
+        previous_logs = []
+        log_stats = log_parser.parse_log_file_incremental(
+            new_log_path, self.state_path,
+            on_previous_log=lambda log_path, log_stats: previous_logs.append(
+                (log_path, log_stats.rows_count)
+            )
+        )
+        self.assertEqual(previous_logs, [(self.log_path, 3)])
+        self.assertEqual(list(log_stats.urls), ["/api/v2/banner/2"])
+
+    def test_rebuild_report_of_previous_log(self):
+        config = dict(
+            main.DEFAULT_CONFIG, INCREMENTAL=True, MEDIAN_MODE="reservoir",
+            TS_DIR=self.tmp_dir.name, REPORT_DIR=self.tmp_dir.name,
+            AGGREGATES_DIR=self.tmp_dir.name
+        )
+        log_files = []
+        for day in [4, 5]:
+            log_date = date(2018, 3, day)
+            log_files.append({
+                "date": log_date,
+                "filepath": os.path.join(
+                    self.tmp_dir.name,
+                    log_generator.get_log_name(log_date)
+                )
+            })
+
+        self.log_path = log_files[0]["filepath"]
+        self.append_to_log(self.log_line.format(1, "0.100") * 2)
+        main.build_report(log_files[0], config, incremental=True)
+        # lines written after the last run before log rotation
+        self.append_to_log(self.log_line.format(1, "0.100"))
+
+        self.log_path = log_files[1]["filepath"]
+        self.append_to_log(self.log_line.format(2, "0.100"))
+        main.build_report(log_files[1], config, incremental=True)
+
+        daily_stats = log_parser.load_daily_stats(
+            date(2018, 3, 4), self.tmp_dir.name, main.create_log_stats(config),
+            os.path.getsize(log_files[0]["filepath"])
+        )
+        self.assertEqual(daily_stats.rows_count, 3)
+        self.assertTrue(report_generator.report_by_date_exists(
+            date(2018, 3, 5), self.tmp_dir.name
+        ))
+
+    def test_restart_on_truncated_log(self):
+        self.append_to_log(self.log_line.format(1, "0.100") * 3)
+        log_parser.parse_log_file_incremental(self.log_path, self.state_path)
+
+        with open(self.log_path, "w", encoding="UTF-8") as f:
+            f.write(self.log_line.format(2, "0.100"))
+        log_stats = log_parser.parse_log_file_incremental(
+            self.log_path, self.state_path
+        )
+        self.assertEqual(list(log_stats.urls), ["/api/v2/banner/2"])
+
+
+class TestPerfStats(unittest.TestCase):
+    def test_stage_time_is_accumulated(self):
+        perf_stats = main.PerfStats()
+        perf_counter_values = [1.0, 1.5, 2.0, 2.25]
+        with mock.patch("time.perf_counter", side_effect=perf_counter_values):
+            with perf_stats.stage("parse"):
+                pass
+            with perf_stats.stage("parse"):
+                pass
+
+        self.assertEqual(perf_stats.timings, {"parse": 0.75})
+
+    def test_log_throughput(self):
+        perf_stats = main.PerfStats()
+        perf_stats.timings = {"parse": 2.0}
+        perf_stats.lines_count = 1000
+        perf_stats.bytes_count = 2 ** 20
+
+        with self.assertLogs(level="INFO") as logs:
+            perf_stats.log()
+
+        output = "\n".join(logs.output)
+        self.assertIn("parse 2.000 s", output)
+        self.assertIn("500 lines/sec, 0.50 MB/sec", output)
+        self.assertIn("of child processes", output)
+
+    def test_profile_to(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_path = os.path.join(tmp_dir, "parse.prof")
+            with main.profile_to(profile_path):
+                log_parser.parse_log_line(
+                    TestParseLogFileParallel.log_line.format(1, "0.100")
+                )
+
+            stats = pstats.Stats(profile_path)
+            self.assertTrue(any(
+                func_name == "parse_log_line"
+                for _, _, func_name in stats.stats
+            ))
+
+        with main.profile_to(None):
+            pass
+
+
+class TestDailyStats(unittest.TestCase):
+    log_line = TestParseLogFileParallel.log_line
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(
+            self.tmp_dir.name, "nginx-access-ui.log-20180304"
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_and_load(self):
+        log_stats = url_stats.LogStats()
+        log_stats.add("/api/1/", 0.5)
+        log_parser.save_daily_stats(
+            log_stats, date(2018, 3, 4), self.tmp_dir.name, 100
+        )
+
+        daily_stats = log_parser.load_daily_stats(
+            date(2018, 3, 4), self.tmp_dir.name, url_stats.LogStats(), 100
+        )
+        self.assertEqual(daily_stats.rows_count, 1)
+        self.assertEqual(daily_stats.urls["/api/1/"].time_sum, 0.5)
+
+        self.assertIsNone(log_parser.load_daily_stats(
+            date(2018, 3, 5), self.tmp_dir.name, url_stats.LogStats(), 100
+        ))
+
+    def test_ignore_stats_with_other_settings(self):
+        log_parser.save_daily_stats(
+            url_stats.LogStats(), date(2018, 3, 4), self.tmp_dir.name, 100
+        )
+
+        self.assertIsNone(log_parser.load_daily_stats(
+            date(2018, 3, 4), self.tmp_dir.name,
+            url_stats.LogStats(median_mode="reservoir"), 100
+        ))
+
+    def test_ignore_stats_of_changed_log(self):
+        log_parser.save_daily_stats(
+            url_stats.LogStats(), date(2018, 3, 4), self.tmp_dir.name, 100
+        )
+
+        self.assertIsNone(log_parser.load_daily_stats(
+            date(2018, 3, 4), self.tmp_dir.name, url_stats.LogStats(), 150
+        ))
+
+    def get_daily_stats(self, **config):
+        config = dict(main.DEFAULT_CONFIG, AGGREGATES_DIR=self.tmp_dir.name,
+                      TS_DIR=self.tmp_dir.name, **config)
+        log_file_info = {"date": date(2018, 3, 4), "filepath": self.log_path}
+        return main.get_daily_stats(
+            log_file_info, config, main.is_incremental(log_file_info, config)
+        )
+
+    def append_to_log(self, lines_count):
+        with open(self.log_path, "a", encoding="UTF-8") as f:
+            f.write(self.log_line.format(1, "0.100") * lines_count)
+
+    def test_reparse_grown_log(self):
+        self.append_to_log(3)
+        self.assertEqual(self.get_daily_stats().rows_count, 3)
+        self.assertEqual(self.get_daily_stats().rows_count, 3)
+
+        self.append_to_log(2)
+        self.assertEqual(self.get_daily_stats().rows_count, 5)
+
+    def test_incremental_log_stats_are_not_saved(self):
+        self.append_to_log(3)
+        self.assertEqual(self.get_daily_stats(INCREMENTAL=True).rows_count, 3)
+        self.append_to_log(2)
+        self.assertEqual(self.get_daily_stats(INCREMENTAL=True).rows_count, 5)
+
+        self.assertFalse(os.path.exists(log_parser.get_daily_stats_path(
+            date(2018, 3, 4), self.tmp_dir.name
+        )))
+
+
+class TestLogStats(unittest.TestCase):
+    def test_exact_median(self):
+        log_stats = url_stats.LogStats("exact")
+        for request_time in (0.3, 0.1, 0.2, 0.5):
+            log_stats.add("/api/", request_time)
+        log_stats.add_error()
+
+        stats = log_stats.urls["/api/"]
+        self.assertEqual(stats.count, 4)
+        self.assertAlmostEqual(stats.time_sum, 1.1)
+        self.assertEqual(stats.time_max, 0.5)
+        self.assertAlmostEqual(stats.median(), 0.25)
+        self.assertEqual(log_stats.rows_count, 5)
+
+    def test_exact_median_of_big_array(self):
+        for times_count in (100, 101):
+            median_estimator = url_stats.ExactMedian()
+            for i in range(times_count):
+                median_estimator.add((i * 37 % times_count) / 10)
+            times = list(median_estimator.times)
+
+            self.assertEqual(median_estimator.times.typecode, "d")
+            self.assertEqual(median_estimator.median(), median(times))
+            with mock.patch("url_stats.np", None):
+                self.assertEqual(median_estimator.median(), median(times))
+            # Stored times are not reordered
+            self.assertEqual(list(median_estimator.times), times)
+
+    def test_reservoir_is_bounded(self):
+        log_stats = url_stats.LogStats("reservoir", reservoir_size=10)
+        for i in range(1000):
+            log_stats.add("/api/", 1.0)
+
+        stats = log_stats.urls["/api/"]
+        self.assertEqual(stats.count, 1000)
+        self.assertEqual(len(stats.median_estimator.sample), 10)
+        self.assertEqual(stats.median(), 1.0)
+
+    def test_merge(self):
+        for median_mode in url_stats.MEDIAN_MODES:
+            first = url_stats.LogStats(median_mode, reservoir_size=10)
+            second = url_stats.LogStats(median_mode, reservoir_size=10)
+            for i in range(20):
+                first.add("/api/", 1.0)
+                second.add("/api/", 3.0)
+                second.add("/other/", 2.0)
+            second.add_error()
+
+            first.merge(second)
+            stats = first.urls["/api/"]
+            self.assertEqual(stats.count, 40)
+            self.assertEqual(stats.time_max, 3.0)
+            self.assertEqual(first.rows_count, 61)
+            self.assertIn(stats.median(), (1.0, 2.0, 3.0))
+
+    def test_percentile_sketch(self):
+        first = url_stats.PercentileSketch(0.01)
+        second = url_stats.PercentileSketch(0.01)
+        for i in range(1, 1001):
+            (first if i % 2 else second).add(i / 1000)
+        first.merge(second)
+
+        for percent in (0, 50, 90, 99, 100):
+            exact = (1 + percent / 100 * 999) / 1000
+            self.assertAlmostEqual(
+                first.percentile(percent), exact, delta=exact * 0.01
+            )
+        self.assertLess(len(first.buckets), 400)
+
+    def test_percentiles_in_url_stats(self):
+        log_stats = url_stats.LogStats(percentiles=(50, 99))
+        for request_time in (0.1, 0.2, 0.3):
+            log_stats.add("/api/", request_time)
+
+        stats = log_stats.urls["/api/"]
+        self.assertAlmostEqual(stats.percentile(50), 0.2, delta=0.002)
+        self.assertLessEqual(stats.percentile(99), 0.3)
+        self.assertNotEqual(
+            log_stats.settings(), url_stats.LogStats().settings()
+        )
+
+        with self.assertRaises(ValueError):
+            url_stats.LogStats(percentiles=(101,))
+
+    def test_unknown_median_mode(self):
+        with self.assertRaises(ValueError):
+            url_stats.LogStats("unknown")
+
+    def test_max_urls(self):
+        log_stats = url_stats.LogStats(max_urls=2)
+        for i in range(5):
+            log_stats.add("/url/{}".format(i), 1.0)
+        log_stats.add("/url/0", 1.0)
+
+        self.assertEqual(
+            list(log_stats.urls), ["/url/0", "/url/1", url_stats.OTHER_URLS]
+        )
+        self.assertEqual(log_stats.urls["/url/0"].count, 2)
+        self.assertEqual(log_stats.urls[url_stats.OTHER_URLS].count, 3)
+
+    def test_merge_with_max_urls(self):
+        first = url_stats.LogStats(max_urls=2)
+        second = url_stats.LogStats(max_urls=2)
+        first.add("/url/0", 1.0)
+        second.add("/url/1", 1.0)
+        second.add("/url/2", 1.0)
+
+        first.merge(second)
+        self.assertEqual(
+            list(first.urls), ["/url/0", "/url/1", url_stats.OTHER_URLS]
+        )
+
+    def test_url_normalizer(self):
+        normalizer = url_normalizer.UrlNormalizer(
+            strip_query=True,
+            collapse_numbers=True,
+            rules=[(r"^/export/[^/]+/", "/export/{file}/")]
+        )
+        log_stats = url_stats.LogStats(url_normalizer=normalizer)
+        log_stats.add("/api/v2/banner/25019354?v=1", 1.0)
+        log_stats.add("/api/v2/banner/1/", 1.0)
+        log_stats.add("/export/report.csv/", 1.0)
+
+        self.assertEqual(list(log_stats.urls), [
+            "/api/v2/banner/{id}", "/api/v2/banner/{id}/",
+            "/export/{file}/"
+        ])
+
+
+class TestUrlNormalizer(unittest.TestCase):
+    def test_collapse_numbers(self):
+        normalizer = url_normalizer.UrlNormalizer(collapse_numbers=True)
+        self.assertEqual(
+            normalizer.normalize("/api/1/banners/v2/12?id=3&page=4"),
+            "/api/{id}/banners/v2/{id}?id=3&page=4"
+        )
+
+    def test_empty_normalizer(self):
+        self.assertFalse(url_normalizer.UrlNormalizer())
+        self.assertIsNone(
+            url_stats.LogStats(url_normalizer=url_normalizer.UrlNormalizer())
+            .url_normalizer
+        )
+
+
+class TestLogGenerator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_generate_gzipped_log(self):
+        log_path = log_generator.generate_log_file(
+            os.path.join(self.tmp_dir.name, "log.gz"),
+            lines_count=2000, urls_count=50, errors_ratio=0.1
+        )
+        log_stats = log_parser.parse_log_file(log_path)
+
+        self.assertEqual(log_stats.rows_count, 2000)
+        self.assertLessEqual(len(log_stats.urls), 50)
+        self.assertAlmostEqual(log_stats.errors / 2000, 0.1, delta=0.03)
+
+    def test_same_seed_same_log(self):
+        first_lines = next(log_generator.generate_log_lines(100, seed=1))
+        second_lines = next(log_generator.generate_log_lines(100, seed=1))
+        self.assertEqual(first_lines, second_lines)
+
+
+class TestPrepareReportList(unittest.TestCase):
+    def setUp(self):
+        self.log_stats = url_stats.LogStats()
+        for i in range(1, 11):
+            for j in range(i):
+                self.log_stats.add("/url/{}".format(i), 1.0)
+
+    def test_top_urls(self):
+        report_list = log_analyzer.prepare_report_list(self.log_stats, 3)
+        self.assertEqual(
+            [url_info["url"] for url_info in report_list],
+            ["/url/10", "/url/9", "/url/8"]
+        )
+        self.assertEqual(report_list[0]["count"], 10)
+        self.assertEqual(report_list[0]["time_perc"], round(10 * 100 / 55, 3))
+        self.assertEqual(report_list[0]["time_med"], 1.0)
+
+    def test_percentile_columns(self):
+        log_stats = url_stats.LogStats(percentiles=(90, 99.9))
+        log_stats.add("/url/1", 0.5)
+
+        url_info = log_analyzer.prepare_report_list(log_stats, 1)[0]
+        self.assertAlmostEqual(url_info["time_p90"], 0.5, delta=0.005)
+        self.assertAlmostEqual(url_info["time_p99.9"], 0.5, delta=0.005)
+
+    def test_report_size_bigger_than_urls_count(self):
+        report_list = log_analyzer.prepare_report_list(self.log_stats, 100)
+        self.assertEqual(len(report_list), 10)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+NUMBER_PLACEHOLDER = "{id}"
+
+
+class UrlNormalizer:
+    """
+    Reduces count of distinct urls before aggregation:
+    strips query strings, collapses numeric path segments
+    to placeholder and applies user regex rules
+    """
+    number_regex = re.compile(r"(?<=/)\d+(?=/|\?|$)")
+
+    def __init__(self, strip_query=False, collapse_numbers=False, rules=()):
+        """
+        :param rules: list of (pattern, replacement) pairs for re.sub
+        """
+        self.strip_query = strip_query
+        self.collapse_numbers = collapse_numbers
+        self.rules = [
+            (re.compile(pattern), replacement)
+            for pattern, replacement in rules
+        ]
+
+    def __bool__(self):
+        return bool(self.strip_query or self.collapse_numbers or self.rules)
+
+    def settings(self):
+        rules = [(regex.pattern, replacement)
+                 for regex, replacement in self.rules]
+        return self.strip_query, self.collapse_numbers, rules
+
+    def normalize(self, url):
+        if self.strip_query:
+            url = url.partition("?")[0]
+
+        if self.collapse_numbers:
+            url = self.number_regex.sub(NUMBER_PLACEHOLDER, url)
+
+        for regex, replacement in self.rules:
+            url = regex.sub(replacement, url)
+
+        return url
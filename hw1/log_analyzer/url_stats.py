@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import random
+import statistics
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MEDIAN_MODES = ("exact", "reservoir")
+DEFAULT_RESERVOIR_SIZE = 1000
+OTHER_URLS = "other"
+DEFAULT_PERCENTILE_ACCURACY = 0.01
+# Request times below it are counted as zero by PercentileSketch
+PERCENTILE_SKETCH_MIN_TIME = 1e-6
+# For smaller arrays sorting is faster than conversion to numpy array
+NUMPY_MEDIAN_MIN_SIZE = 64
+
+
+def median(values):
+    """
+    Median of float values. For big arrays numpy (if installed)
+    selects middle values with np.partition instead of sorting
+    """
+    values_count = len(values)
+    if np is None or values_count < NUMPY_MEDIAN_MIN_SIZE:
+        return statistics.median(values)
+
+    if isinstance(values, array):
+        values = np.frombuffer(values, dtype=np.float64)
+    else:
+        values = np.asarray(values, dtype=np.float64)
+
+    middle = values_count // 2
+    if values_count % 2:
+        return float(np.partition(values, middle)[middle])
+
+    values = np.partition(values, (middle - 1, middle))
+    return float((values[middle - 1] + values[middle]) / 2)
+
+
+class ExactMedian:
+    """
+    Keeps every request time (8 bytes per time in array), median is exact
+    """
+    __slots__ = ("times",)
+
+    def __init__(self):
+        self.times = array("d")
+
+    def add(self, request_time):
+        self.times.append(request_time)
+
+    def merge(self, other):
+        self.times.extend(other.times)
+
+    def median(self):
+        return median(self.times)
+
+
+class ReservoirMedian:
+    """
+    Keeps a uniform random sample of at most `size` request times,
+    median is estimated by the sample median
+    """
+    __slots__ = ("size", "seen", "sample")
+
+    def __init__(self, size=DEFAULT_RESERVOIR_SIZE):
+        self.size = size
+        self.seen = 0
+        self.sample = []
+
+    def add(self, request_time):
+        self.seen += 1
+        if len(self.sample) < self.size:
+            self.sample.append(request_time)
+        else:
+            idx = random.randrange(self.seen)
+            if idx < self.size:
+                self.sample[idx] = request_time
+
+    def merge(self, other):
+        seen = self.seen + other.seen
+        if len(self.sample) + len(other.sample) <= self.size:
+            self.sample.extend(other.sample)
+        else:
+            # Take from every sample proportionally to the number
+            # of values it represents
+            own_count = round(self.size * self.seen / seen)
+            own_count = min(own_count, len(self.sample))
+            other_count = min(self.size - own_count, len(other.sample))
+            own_count = min(self.size - other_count, len(self.sample))
+
+            self.sample = random.sample(self.sample, own_count) + \
+                random.sample(other.sample, other_count)
+
+        self.seen = seen
+
+    def median(self):
+        return median(self.sample)
+
+
+class PercentileSketch:
+    """
+    Mergeable sketch of request times distribution (like DDSketch):
+    times are counted in buckets with logarithmically growing bounds,
+    so any percentile is estimated with bounded relative error.
+    Count of buckets depends only on range of times, not on their count
+    """
+    __slots__ = ("relative_accuracy", "multiplier", "zero_count", "buckets")
+
+    def __init__(self, relative_accuracy=DEFAULT_PERCENTILE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.multiplier = 1 / math.log(gamma)
+        self.zero_count = 0
+        self.buckets = {}
+
+    def add(self, request_time):
+        if request_time < PERCENTILE_SKETCH_MIN_TIME:
+            self.zero_count += 1
+            return
+
+        idx = math.ceil(math.log(request_time) * self.multiplier)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches with different accuracy")
+
+        self.zero_count += other.zero_count
+        for idx, count in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + count
+
+    def percentile(self, percent):
+        """
+        Estimate value, below which percent of request times are
+        """
+        count = self.zero_count + sum(self.buckets.values())
+        if not count:
+            raise ValueError("Percentile of empty sketch")
+
+        rank = percent / 100 * (count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen > rank:
+                break
+
+        # Middle of bucket (gamma^(idx-1), gamma^idx] by relative error
+        gamma = math.exp(1 / self.multiplier)
+        return 2 * gamma ** idx / (gamma + 1)
+
+
+class UrlStats:
+    """
+    Online aggregate of request times for one url:
+    count, sum and max are exact, median depends on median estimator,
+    percentiles are estimated by optional PercentileSketch
+    """
+    __slots__ = ("count", "time_sum", "time_max", "median_estimator",
+                 "percentile_sketch")
+
+    def __init__(self, median_estimator, percentile_sketch=None):
+        self.count = 0
+        self.time_sum = 0.0
+        self.time_max = 0.0
+        self.median_estimator = median_estimator
+        self.percentile_sketch = percentile_sketch
+
+    def add(self, request_time):
+        self.count += 1
+        self.time_sum += request_time
+        if request_time > self.time_max:
+            self.time_max = request_time
+        self.median_estimator.add(request_time)
+        if self.percentile_sketch is not None:
+            self.percentile_sketch.add(request_time)
+
+    def merge(self, other):
+        self.count += other.count
+        self.time_sum += other.time_sum
+        self.time_max = max(self.time_max, other.time_max)
+        self.median_estimator.merge(other.median_estimator)
+        if self.percentile_sketch is not None:
+            self.percentile_sketch.merge(other.percentile_sketch)
+
+    def median(self):
+        return self.median_estimator.median()
+
+    def percentile(self, percent):
+        # Estimation can't be bigger than exact max
+        return min(self.percentile_sketch.percentile(percent), self.time_max)
+
+
+class LogStats:
+    """
+    Parsed log: errors count and UrlStats for every url
+    """
+
+    def __init__(self, median_mode="exact",
+                 reservoir_size=DEFAULT_RESERVOIR_SIZE,
+                 max_urls=0, url_normalizer=None, percentiles=(),
+                 percentile_accuracy=DEFAULT_PERCENTILE_ACCURACY):
+        """
+        :param max_urls: max count of distinct urls (0 - unlimited),
+        requests of new urls over the limit are added to OTHER_URLS
+        :param url_normalizer: UrlNormalizer, which is applied to urls
+        before aggregation
+        :param percentiles: percents (e.g. 90, 95, 99), for which
+        request time percentiles are estimated by PercentileSketch
+        :param percentile_accuracy: relative accuracy of percentiles
+        """
+        if median_mode not in MEDIAN_MODES:
+            msg = "Unknown median mode: {}, available modes: {}"
+            raise ValueError(msg.format(median_mode, ", ".join(MEDIAN_MODES)))
+
+        for percent in percentiles:
+            if not 0 <= percent <= 100:
+                msg = "Percentile must be in range [0, 100]: {}"
+                raise ValueError(msg.format(percent))
+
+        if not 0 < percentile_accuracy < 1:
+            msg = "Percentile accuracy must be in range (0, 1): {}"
+            raise ValueError(msg.format(percentile_accuracy))
+
+        self.median_mode = median_mode
+        self.reservoir_size = reservoir_size
+        self.max_urls = max_urls
+        self.url_normalizer = url_normalizer if url_normalizer else None
+        self.percentiles = tuple(percentiles)
+        self.percentile_accuracy = percentile_accuracy
+        self.errors = 0
+        self.urls = {}
+
+    def settings(self):
+        """
+        Aggregation settings: LogStats can be merged
+        only if their settings are equal
+        """
+        return (
+            self.median_mode,
+            self.reservoir_size,
+            self.max_urls,
+            self.url_normalizer.settings() if self.url_normalizer else None,
+            self.percentiles,
+            self.percentile_accuracy if self.percentiles else None
+        )
+
+    def new_empty(self):
+        """
+        Create empty LogStats with the same settings
+        """
+        return LogStats(self.median_mode, self.reservoir_size,
+                        self.max_urls, self.url_normalizer,
+                        self.percentiles, self.percentile_accuracy)
+
+    def new_url_stats(self):
+        if self.median_mode == "reservoir":
+            median_estimator = ReservoirMedian(self.reservoir_size)
+        else:
+            median_estimator = ExactMedian()
+
+        percentile_sketch = None
+        if self.percentiles:
+            percentile_sketch = PercentileSketch(self.percentile_accuracy)
+
+        return UrlStats(median_estimator, percentile_sketch)
+
+    def get_url_stats(self, url):
+        """
+        Get UrlStats for url, create it if needed.
+        Over max_urls limit OTHER_URLS stats are returned for new urls
+        """
+        url_stats = self.urls.get(url)
+        if url_stats is None:
+            if self.max_urls and len(self.urls) >= self.max_urls:
+                url = OTHER_URLS
+                url_stats = self.urls.get(url)
+
+            if url_stats is None:
+                url_stats = self.urls[url] = self.new_url_stats()
+
+        return url_stats
+
+    def add(self, url, request_time):
+        if self.url_normalizer is not None:
+            url = self.url_normalizer.normalize(url)
+
+        url_stats = self.urls.get(url)
+        if url_stats is None:
+            url_stats = self.get_url_stats(url)
+
+        url_stats.add(request_time)
+
+    def add_error(self):
+        self.errors += 1
+
+    def merge(self, other):
+        """
+        Merge other LogStats (for example, parsed from another
+        part of log) into this one
+        """
+        self.errors += other.errors
+        for url, other_stats in other.urls.items():
+            if url not in self.urls and (
+                    not self.max_urls or len(self.urls) < self.max_urls):
+                self.urls[url] = other_stats
+            else:
+                self.get_url_stats(url).merge(other_stats)
+
+    @property
+    def rows_count(self):
+        return self.errors + sum(u.count for u in self.urls.values())
+
+    @property
+    def time_sum(self):
+        return sum(u.time_sum for u in self.urls.values())
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import random
 from collections import Counter
-from itertools import combinations
+from functools import lru_cache
+from itertools import combinations, combinations_with_replacement, product
 
 # -----------------
 # Реализуйте функцию best_hand, которая принимает на вход
@@ -35,6 +37,37 @@ RANKS = {str(i): i for i in range(2, 10)}
 RANKS.update({"T": 10, "J": 11, "Q": 12, "K": 13, "A": 14})
 RANKS_INVERSE = {v: k for k, v in RANKS.items()}
 
+# Карта кодируется целым числом (как в оценщике Cactus Kev):
+# биты 16-28 - битовая маска ранга, 12-15 - маска масти,
+# 8-11 - ранг, 0-7 - простое число ранга
+SUITS = "CDHS"
+RANK_PRIMES = dict(zip(
+    range(2, 15), (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+))
+SUIT_MASK = 0xF000
+PRIME_MASK = 0xFF
+# Максимальное количество рангов в значении руки (у двух пар - 2 + 5)
+VALUE_RANKS_COUNT = 7
+CARD_CODES = {
+    rank_symbol + suit: (
+        1 << (rank - 2 + 16) | 1 << (SUITS.index(suit) + 12)
+        | rank << 8 | RANK_PRIMES[rank]
+    )
+    for rank_symbol, rank in RANKS.items()
+    for suit in SUITS
+}
+CARD_NAMES = {code: card for card, code in CARD_CODES.items()}
+# Масти, картами которых может быть джокер
+JOKER_SUITS = {"?B": "CS", "?R": "HD"}
+# Количество рук, которые best_hands_batch обрабатывает за раз
+BATCH_CHUNK_SIZE = 65536
+# Веса рангов 2..A, у которых суммы любых 5 рангов (ранг встречается
+# не больше 4 раз) различны (найдены жадным перебором), сумма весов
+# используется как индекс в таблице значений рук без флеша
+RANK_WEIGHTS = dict(zip(range(2, 15), (
+    0, 1, 5, 22, 94, 312, 992, 2422, 5624, 12522, 19998, 43258, 79415
+)))
+
 
 def hand_rank(hand):
     """Возвращает значение определяющее ранг 'руки'"""
@@ -119,109 +152,359 @@ def two_pair(ranks):
     return sorted_pairs_ranks if len(sorted_pairs_ranks) == 2 else None
 
 
-def compare_ranks(ranks_1, ranks_2):
-    ranks_1_sorted = sorted(ranks_1, reverse=True)
-    ranks_2_sorted = sorted(ranks_2, reverse=True)
-    return ranks_1_sorted > ranks_2_sorted
+def rank_to_value(rank):
+    """Переводит значение hand_rank в одно целое число с тем же порядком:
+    старшие 4 бита - категория руки, далее по 4 бита на каждый ранг
+    (списки рангов сортируются от большего к меньшему, как их сравнивает
+    покер), недостающие ранги дополняются нулями"""
+    ranks = []
+    for item in rank[1:]:
+        if isinstance(item, list):
+            ranks.extend(sorted(item, reverse=True))
+        else:
+            ranks.append(item)
+
+    value = rank[0]
+    for r in ranks + [0] * (VALUE_RANKS_COUNT - len(ranks)):
+        value = value << 4 | r
+    return value
+
+
+def ranks_value(ranks, is_flush):
+    """Значение руки (как rank_to_value(hand_rank(hand))) по рангам карт,
+    отсортированным от большего к меньшему, и признаку флеша"""
+    counts = {r: ranks.count(r) for r in ranks}
+    groups = sorted(counts, key=lambda r: (counts[r], r), reverse=True)
+    is_straight = len(counts) == 5 and ranks[0] - ranks[4] == 4
+
+    if is_straight and is_flush:
+        rank = (8, ranks[0])
+    elif counts[groups[0]] == 4:
+        rank = (7, groups[0], groups[1])
+    elif counts[groups[0]] == 3 and counts[groups[1]] == 2:
+        rank = (6, groups[0], groups[1])
+    elif is_flush:
+        rank = (5, ranks)
+    elif is_straight:
+        rank = (4, ranks[0])
+    elif counts[groups[0]] == 3:
+        rank = (3, groups[0], ranks)
+    elif counts[groups[0]] == 2 and counts[groups[1]] == 2:
+        rank = (2, groups[:2], ranks)
+    elif counts[groups[0]] == 2:
+        rank = (1, groups[0], ranks)
+    else:
+        rank = (0, ranks)
 
+    return rank_to_value(rank)
 
-def compare_hands(hand_1, hand_2):
-    """Сравнение двух рук из 5 карт. Возвращает True, если hand_1 сильнее, иначе - False"""
-    rank_hand_1 = hand_rank(hand_1)
-    rank_hand_2 = hand_rank(hand_2)
 
-    if rank_hand_1[0] != rank_hand_2[0]:
-        return rank_hand_1[0] > rank_hand_2[0]
+def make_value_tables():
+    """Таблицы значений всех рук из 5 карт:
+    по маске рангов для флешей и для 5 разных рангов без флеша,
+    по произведению простых чисел рангов для рук с парами"""
+    flush_values = [0] * (1 << 13)
+    unique5_values = [0] * (1 << 13)
+    prime_product_values = {}
 
-    if rank_hand_1[0] == 8:
-        return rank_hand_1[1] > rank_hand_2[1]
-    elif rank_hand_1[0] == 7:
-        if rank_hand_1[1] != rank_hand_2[1]:
-            return rank_hand_1[1] > rank_hand_2[1]
-        else:
-            return rank_hand_1[2] > rank_hand_2[2]
-    elif rank_hand_1[0] == 6:
-        if rank_hand_1[1] != rank_hand_2[1]:
-            return rank_hand_1[1] > rank_hand_2[1]
-        else:
-            return rank_hand_1[2] > rank_hand_2[2]
-    elif rank_hand_1[0] == 5:
-        return compare_ranks(rank_hand_1[1], rank_hand_2[1])
-    elif rank_hand_1[0] == 4:
-        return rank_hand_1[1] > rank_hand_2[1]
-    elif rank_hand_1[0] == 3:
-        if rank_hand_1[1] != rank_hand_2[1]:
-            return rank_hand_1[1] > rank_hand_2[1]
-        else:
-            return compare_ranks(rank_hand_1[2], rank_hand_2[2])
-    elif rank_hand_1[0] == 2:
-        if rank_hand_1[1] != rank_hand_2[1]:
-            return rank_hand_1[1] > rank_hand_2[1]
-        else:
-            return compare_ranks(rank_hand_1[2], rank_hand_2[2])
-    elif rank_hand_1[0] == 1:
-        if rank_hand_1[1] != rank_hand_2[1]:
-            return rank_hand_1[1] > rank_hand_2[1]
+    for ranks in combinations_with_replacement(range(14, 1, -1), 5):
+        if len(set(ranks)) == 1:
+            continue
+
+        ranks = list(ranks)
+        if len(set(ranks)) == 5:
+            rank_bits = sum(1 << (r - 2) for r in ranks)
+            flush_values[rank_bits] = ranks_value(ranks, True)
+            unique5_values[rank_bits] = ranks_value(ranks, False)
         else:
-            return compare_ranks(rank_hand_1[2], rank_hand_2[2])
-    else:
-        return compare_ranks(rank_hand_1[1], rank_hand_2[1])
+            prime_product = 1
+            for r in ranks:
+                prime_product *= RANK_PRIMES[r]
+            prime_product_values[prime_product] = ranks_value(ranks, False)
+
+    return flush_values, unique5_values, prime_product_values
+
+
+FLUSH_VALUES, UNIQUE5_VALUES, PRIME_PRODUCT_VALUES = make_value_tables()
 
 
-def get_jokers_combs(hand):
-    combs = []
+def encode_hand(hand):
+    """Возвращает список целочисленных кодов карт"""
+    return [CARD_CODES[card] for card in hand]
 
-    joker = [card for card in hand if "?" in card]
-    if not joker:
-        return [hand]
-    joker = joker[0]
 
-    cards = [card for card in hand if card != joker]
+def evaluate_5cards(c1, c2, c3, c4, c5):
+    """Значение руки из 5 карт по их кодам. Чем больше значение,
+    тем сильнее рука, порядок совпадает с порядком hand_rank"""
+    rank_bits = (c1 | c2 | c3 | c4 | c5) >> 16
+    if c1 & c2 & c3 & c4 & c5 & SUIT_MASK:
+        return FLUSH_VALUES[rank_bits]
 
-    joker_suits = ["C", "S"] if joker[-1] == "B" else ["H", "D"]
-    joker_cards = [rank + joker_suits[0] for rank in RANKS] + [rank + joker_suits[1] for rank in RANKS]
-    for joker_card in joker_cards:
-        if joker_card not in cards:
-            new_hand = cards + [joker_card]
-            combs.extend(get_jokers_combs(new_hand))
+    value = UNIQUE5_VALUES[rank_bits]
+    if value:
+        return value
 
-    return combs
+    return PRIME_PRODUCT_VALUES[
+        (c1 & PRIME_MASK) * (c2 & PRIME_MASK) * (c3 & PRIME_MASK)
+        * (c4 & PRIME_MASK) * (c5 & PRIME_MASK)
+    ]
 
 
-def get_hands(hand):
-    return [sorted(list(comb)) for comb in combinations(hand, 5)]
+def get_code_rank(code):
+    return code >> 8 & 0xF
 
 
-def get_unique_hands(hands):
-    hands = set([" ".join(hand) for hand in hands])
-    hands = [hand.split() for hand in hands]
-    return hands
+def find_straight(cards):
+    """Возвращает 5 карт старшего стрита или None.
+    cards - коды карт разных рангов, отсортированные от большего к меньшему"""
+    for idx in range(len(cards) - 4):
+        if get_code_rank(cards[idx]) - get_code_rank(cards[idx + 4]) == 4:
+            return cards[idx:idx + 5]
 
+    return None
+
+
+def get_kickers(rank_cards, ranks, exclude, count):
+    """Возвращает count карт старших рангов, кроме рангов из exclude"""
+    return [rank_cards[r][0] for r in ranks if r not in exclude][:count]
+
+
+def best_5cards(cards):
+    """Возвращает лучшие 5 карт из 5 и более кодов карт и их значение
+    (как у evaluate_5cards). Рука строится по гистограммам рангов и мастей,
+    без перебора сочетаний по 5 карт"""
+    rank_cards = {}
+    suit_cards = {}
+    for code in sorted(cards, reverse=True):
+        rank_cards.setdefault(get_code_rank(code), []).append(code)
+        suit_cards.setdefault(code & SUIT_MASK, []).append(code)
+    ranks = list(rank_cards)
+
+    # если флеш можно собрать в нескольких мастях, выбирается старший
+    # стрит-флеш, а если его нет - старший флеш
+    straight_flush = None
+    flush_cards = None
+    for suited in suit_cards.values():
+        if len(suited) >= 5:
+            suited_straight = find_straight(suited)
+            if suited_straight and (not straight_flush or get_code_rank(
+                    suited_straight[0]) > get_code_rank(straight_flush[0])):
+                straight_flush = suited_straight
+            if not flush_cards or evaluate_5cards(*suited[:5]) > \
+                    evaluate_5cards(*flush_cards):
+                flush_cards = suited[:5]
+
+    if straight_flush:
+        return evaluate_5cards(*straight_flush), straight_flush
+
+    quads = [r for r in ranks if len(rank_cards[r]) >= 4]
+    trips = [r for r in ranks if len(rank_cards[r]) >= 3]
+    pairs = [r for r in ranks if len(rank_cards[r]) >= 2]
+
+    straight = find_straight([rank_cards[r][0] for r in ranks])
+
+    if quads:
+        best = rank_cards[quads[0]][:4] + \
+            get_kickers(rank_cards, ranks, quads[:1], 1)
+    elif trips and len(pairs) >= 2:
+        pair = pairs[1] if pairs[0] == trips[0] else pairs[0]
+        best = rank_cards[trips[0]][:3] + rank_cards[pair][:2]
+    elif flush_cards:
+        best = flush_cards
+    elif straight:
+        best = straight
+    elif trips:
+        best = rank_cards[trips[0]][:3] + \
+            get_kickers(rank_cards, ranks, trips[:1], 2)
+    elif len(pairs) >= 2:
+        best = rank_cards[pairs[0]][:2] + rank_cards[pairs[1]][:2] + \
+            get_kickers(rank_cards, ranks, pairs[:2], 1)
+    elif pairs:
+        best = rank_cards[pairs[0]][:2] + \
+            get_kickers(rank_cards, ranks, pairs[:1], 3)
+    else:
+        best = get_kickers(rank_cards, ranks, (), 5)
 
-def get_best_hand(hands):
-    hands = get_unique_hands(hands)
-    _best_hand = hands[0]
-    for _hand in hands[1:]:
-        if compare_hands(_hand, _best_hand):
-            _best_hand = _hand
+    return evaluate_5cards(*best), best
 
-    return _best_hand
+
+def hand_value(hand):
+    """Значение руки из 5 карт (одно сравнимое целое число)"""
+    return evaluate_5cards(*encode_hand(hand))
+
+
+def compare_hands(hand_1, hand_2):
+    """Сравнение двух рук из 5 карт. Возвращает True, если hand_1 сильнее, иначе - False"""
+    return hand_value(hand_1) > hand_value(hand_2)
+
+
+def get_joker_cards(joker, cards, jokers):
+    """Возвращает коды карт, которыми имеет смысл заменить джокер.
+    Масть замены важна только для флеша: если в масти нельзя собрать
+    флеш даже со всеми джокерами, то от всех таких мастей остается
+    по одной карте каждого ранга
+    cards - коды карт руки без джокеров, jokers - все джокеры руки"""
+    joker_cards = []
+    for rank in range(14, 1, -1):
+        any_suit_card = None
+        for suit in JOKER_SUITS[joker]:
+            code = CARD_CODES[RANKS_INVERSE[rank] + suit]
+            if code in cards:
+                continue
+
+            suit_mask = code & SUIT_MASK
+            suit_cards_count = len([c for c in cards if c & suit_mask]) + \
+                len([j for j in jokers if suit in JOKER_SUITS[j]])
+            if suit_cards_count >= 5:
+                joker_cards.append(code)
+            elif any_suit_card is None:
+                any_suit_card = code
+
+        if any_suit_card is not None:
+            joker_cards.append(any_suit_card)
+
+    return joker_cards
 
 
 def best_hand(hand):
     """Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт """
-    hands = get_hands(hand)
-    return get_best_hand(hands)
+    _, cards = best_5cards(encode_hand(hand))
+    return [CARD_NAMES[code] for code in cards]
+
+
+@lru_cache(maxsize=None)
+def get_numpy_tables():
+    """Таблицы для best_hands_batch в виде массивов numpy
+    (numpy импортируется только при первом вызове): значения флешей
+    по маске рангов, значения остальных рук по сумме весов рангов
+    и веса рангов по рангу"""
+    import numpy as np
+
+    # Веса в float64, чтобы суммы по сочетаниям считались умножением матриц
+    rank_weights = np.zeros(15, dtype=np.float64)
+    for rank, weight in RANK_WEIGHTS.items():
+        rank_weights[rank] = weight
+
+    suit_indices = np.zeros(16, dtype=np.intp)
+    for idx in range(len(SUITS)):
+        suit_indices[1 << idx] = idx
+
+    weight_values = np.zeros(
+        5 * max(RANK_WEIGHTS.values()) + 1, dtype=np.int64
+    )
+    for ranks in combinations_with_replacement(range(2, 15), 5):
+        if len(set(ranks)) == 1:
+            continue
+
+        rank_bits = sum(1 << (r - 2) for r in ranks)
+        value = UNIQUE5_VALUES[rank_bits] if len(set(ranks)) == 5 else 0
+        if not value:
+            prime_product = 1
+            for r in ranks:
+                prime_product *= RANK_PRIMES[r]
+            value = PRIME_PRODUCT_VALUES[prime_product]
+        weight_values[sum(RANK_WEIGHTS[r] for r in ranks)] = value
+
+    return {
+        "flush": np.array(FLUSH_VALUES, dtype=np.int64),
+        "weight_values": weight_values,
+        "rank_weights": rank_weights,
+        "suit_indices": suit_indices,
+    }
+
+
+@lru_cache(maxsize=None)
+def get_numpy_combinations(cards_count):
+    """Массив (сочетаний, 5) индексов карт всех сочетаний по 5
+    и матрица (cards_count, сочетаний), умножение на которую
+    суммирует веса карт каждого сочетания"""
+    import numpy as np
+
+    combs = np.array(list(combinations(range(cards_count), 5)), dtype=np.intp)
+    comb_matrix = np.zeros((cards_count, len(combs)), dtype=np.float64)
+    comb_matrix[combs, np.arange(len(combs))[:, None]] = 1
+    return combs, comb_matrix
+
+
+def evaluate_5cards_batch(cards):
+    """Значения рук (как у evaluate_5cards) для массива кодов карт
+    формы (..., 5)"""
+    import numpy as np
+
+    tables = get_numpy_tables()
+    weights = tables["rank_weights"][cards >> 8 & 0xF].sum(axis=-1)
+    values = tables["weight_values"][weights.astype(np.intp)]
+
+    is_flush = np.bitwise_and.reduce(cards, axis=-1) & SUIT_MASK != 0
+    if is_flush.any():
+        rank_bits = np.bitwise_or.reduce(cards[is_flush], axis=-1) >> 16
+        values[is_flush] = tables["flush"][rank_bits]
+
+    return values
+
+
+def best_hands_batch(cards, chunk_size=BATCH_CHUNK_SIZE):
+    """Лучшие руки для массива рук.
+    cards - целочисленный массив формы (N, 7) кодов карт (CARD_CODES),
+    в строке может быть и другое количество карт, но не меньше 5.
+    Возвращает массив (N,) значений лучших рук (как у evaluate_5cards)
+    и массив (N, 5) индексов карт лучших рук в строках cards"""
+    import numpy as np
+
+    tables = get_numpy_tables()
+    cards = np.asarray(cards, dtype=np.int64)
+    combs, comb_matrix = get_numpy_combinations(cards.shape[1])
+    values = np.empty(len(cards), dtype=np.int64)
+    best_combs = np.empty(len(cards), dtype=np.intp)
+
+    for start in range(0, len(cards), chunk_size):
+        chunk = cards[start:start + chunk_size]
+        # Значения всех сочетаний без учета флеша, (рук в чанке, сочетаний)
+        weights = tables["rank_weights"][chunk >> 8 & 0xF] @ comb_matrix
+        combs_values = tables["weight_values"][weights.astype(np.intp)]
+
+        # Флеш возможен только в руках, где есть 5 карт одной масти
+        suits = tables["suit_indices"][chunk >> 12 & 0xF]
+        suits += np.arange(len(chunk))[:, None] * len(SUITS)
+        suits_counts = np.bincount(
+            suits.ravel(), minlength=len(chunk) * len(SUITS)
+        ).reshape(len(chunk), len(SUITS))
+        flush_rows = np.flatnonzero(suits_counts.max(axis=1) >= 5)
+        if len(flush_rows):
+            combs_values[flush_rows] = np.maximum(
+                combs_values[flush_rows],
+                evaluate_5cards_batch(chunk[flush_rows][:, combs])
+            )
+
+        chunk_best = combs_values.argmax(axis=1)
+        best_combs[start:start + chunk_size] = chunk_best
+        values[start:start + chunk_size] = \
+            combs_values[np.arange(len(chunk)), chunk_best]
+
+    return values, combs[best_combs]
+
+
+def best_wild_5cards(hand):
+    """Возвращает значение лучшей руки (как у evaluate_5cards)
+    и коды её 5 карт для руки, которая может включать джокеров"""
+    jokers = [card for card in hand if card in JOKER_SUITS]
+    cards = encode_hand([card for card in hand if card not in JOKER_SUITS])
+
+    best_value, best_cards = -1, None
+    for joker_cards in product(*[
+        get_joker_cards(joker, cards, jokers) for joker in jokers
+    ]):
+        value, hand_cards = best_5cards(cards + list(joker_cards))
+        if value > best_value:
+            best_value, best_cards = value, hand_cards
+
+    return best_value, best_cards
 
 
 def best_wild_hand(hand):
     """best_hand но с джокерами"""
-    hands = list()
-    joker_combs = get_jokers_combs(hand)
-    for comb in joker_combs:
-        hands.extend(get_hands(comb))
-
-    return get_best_hand(hands)
+    _, cards = best_wild_5cards(hand)
+    return [CARD_NAMES[code] for code in cards]
 
 
 def test_best_hand():
@@ -232,6 +515,60 @@ def test_best_hand():
             == ['8C', '8S', 'TC', 'TD', 'TH'])
     assert (sorted(best_hand("JD TC TH 7C 7D 7S 7H".split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    rng = random.Random(0)
+    deck = list(CARD_CODES.values())
+    for _ in range(5000):
+        cards = rng.sample(deck, 7)
+        value, best = best_5cards(cards)
+        assert value == max(
+            evaluate_5cards(*comb) for comb in combinations(cards, 5)
+        )
+        assert len(best) == 5 and set(best) <= set(cards)
+    # стрит-флеши и флеши в двух мастях
+    assert (sorted(best_hand("AH 2H 3H 4H 5H 6H 9S TS JS QS KS".split()))
+            == ['9S', 'JS', 'KS', 'QS', 'TS'])
+    assert (sorted(best_hand("2H 3H 4H 5H 7H 9S TS JS QS 2S".split()))
+            == ['2S', '9S', 'JS', 'QS', 'TS'])
+    for _ in range(300):
+        cards = rng.sample(deck, 12)
+        assert best_5cards(cards)[0] == max(
+            evaluate_5cards(*comb) for comb in combinations(cards, 5)
+        )
+    print('OK')
+
+
+def test_hand_value():
+    print("test_hand_value...")
+    rng = random.Random(0)
+    deck = list(CARD_CODES)
+    for _ in range(5000):
+        hand = rng.sample(deck, 5)
+        assert hand_value(hand) == rank_to_value(hand_rank(hand))
+    assert (hand_value("TC JC QC KC AC".split())
+            > hand_value("9D TD JD QD KD".split())
+            > hand_value("2C 2D 2H 2S 3C".split()))
+    assert (hand_value("AC AD KH KS 2C".split())
+            > hand_value("AH AS QC QD KC".split()))
+    assert (hand_value("5C 5D 5H 9S 8C".split())
+            == hand_value("5C 5D 5S 9H 8D".split()))
+    print('OK')
+
+
+def test_best_hands_batch():
+    print("test_best_hands_batch...")
+    try:
+        import numpy as np
+    except ImportError:
+        print("numpy is not installed, skipped")
+        return
+
+    rng = random.Random(0)
+    deck = list(CARD_CODES.values())
+    hands = [rng.sample(deck, 7) for _ in range(3000)]
+    values, indices = best_hands_batch(np.array(hands), chunk_size=1000)
+    for hand, value, hand_indices in zip(hands, values, indices):
+        assert value == best_5cards(hand)[0]
+        assert value == evaluate_5cards(*[hand[i] for i in hand_indices])
     print('OK')
 
 
@@ -243,9 +580,15 @@ def test_best_wild_hand():
             == ['7C', 'TC', 'TD', 'TH', 'TS'])
     assert (sorted(best_wild_hand("JD TC TH 7C 7D 7S 7H".split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    assert (sorted(best_wild_hand("2C 3C 4C 5C 9H ?B ?R".split()))
+            == ['2C', '3C', '4C', '5C', '6C'])
+    assert (sorted(best_wild_hand("AS AH KS QS JS 2D ?B".split()))
+            == ['AS', 'JS', 'KS', 'QS', 'TS'])
     print('OK')
 
 
 if __name__ == '__main__':
+    test_hand_value()
     test_best_hand()
+    test_best_hands_batch()
     test_best_wild_hand()
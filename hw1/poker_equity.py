@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import random
+from collections import deque
+from itertools import combinations, permutations
+from concurrent.futures import ProcessPoolExecutor
+
+import poker
+
+# -----------------
+# Оценка шансов игроков (equity) методом Монте-Карло: известны карты
+# игроков и часть борда, недостающие карты борда раздаются случайно
+# из оставшейся колоды (в колоде могут быть джокеры).
+# Розыгрыши выполняются пачками, каждая пачка - со своим seed, поэтому
+# результат при одном seed не зависит от количества процессов.
+# Расчет останавливается, когда доверительный интервал equity
+# каждого игрока становится уже заданной точности.
+#
+# Если неизвестных карт мало, точные шансы считает exact_equity
+# перебором всех досдач борда. Досдачи, которые переходят друг в друга
+# при перестановке мастей, не меняющей известные карты, дают одинаковый
+# результат, поэтому оцениваются один раз (до 24 раз меньше оценок).
+# -----------------
+
+BOARD_SIZE = 5
+BATCH_SIZE = 2000
+DEFAULT_MAX_TRIALS = 1000000
+DEFAULT_PRECISION = 0.005
+# z-оценка для 95% доверительного интервала
+CONFIDENCE_Z = 1.96
+
+
+def get_deck(dead_cards, jokers=False):
+    """Возвращает колоду без известных карт"""
+    deck = list(poker.CARD_CODES)
+    if jokers:
+        deck.extend(poker.JOKER_SUITS)
+    return [card for card in deck if card not in dead_cards]
+
+
+def check_cards(players, board):
+    known_cards = [card for hole in players for card in hole] + list(board)
+    unknown_cards = [
+        card for card in known_cards
+        if card not in poker.CARD_CODES and card not in poker.JOKER_SUITS
+    ]
+    if unknown_cards:
+        raise ValueError("Unknown cards: {}".format(" ".join(unknown_cards)))
+
+    if len(set(known_cards)) != len(known_cards):
+        msg = "Cards are repeated: {}"
+        raise ValueError(msg.format(" ".join(known_cards)))
+
+    if len(board) > BOARD_SIZE:
+        raise ValueError("Board has more than {} cards".format(BOARD_SIZE))
+
+    if len(players) < 2:
+        raise ValueError("At least 2 players are needed")
+
+
+def get_hand_value(cards):
+    """Значение лучшей руки из карт игрока и борда"""
+    if any(card in poker.JOKER_SUITS for card in cards):
+        return poker.best_wild_5cards(cards)[0]
+    return poker.best_5cards(poker.encode_hand(cards))[0]
+
+
+def get_winners(players, board):
+    """Возвращает индексы игроков с лучшей рукой"""
+    values = [get_hand_value(hole + board) for hole in players]
+    best_value = max(values)
+    return [idx for idx, value in enumerate(values) if value == best_value]
+
+
+def simulate(players, board, trials, seed, jokers=False):
+    """Разыгрывает trials случайных досдач борда.
+    Возвращает trials и списки по игрокам: количество единоличных побед,
+    количество ничьих и сумму долей банка"""
+    rng = random.Random(seed)
+    deck = get_deck(
+        set(card for hole in players for card in hole) | set(board), jokers
+    )
+    missing_count = BOARD_SIZE - len(board)
+
+    wins = [0] * len(players)
+    ties = [0] * len(players)
+    shares = [0.0] * len(players)
+    for _ in range(trials):
+        winners = get_winners(players, board + rng.sample(deck, missing_count))
+        if len(winners) == 1:
+            wins[winners[0]] += 1
+        else:
+            for idx in winners:
+                ties[idx] += 1
+        for idx in winners:
+            shares[idx] += 1 / len(winners)
+
+    return trials, wins, ties, shares
+
+
+def map_in_order(func, tasks, workers=1):
+    """Генератор результатов func(*task) в порядке задач.
+    При workers > 1 задачи выполняются в пуле процессов, в очереди
+    одновременно не больше workers * 2 задач. Если генератор закрыт
+    раньше времени, оставшиеся задачи отменяются"""
+    if workers <= 1:
+        for task in tasks:
+            yield func(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        try:
+            for task in tasks:
+                futures.append(executor.submit(func, *task))
+                if len(futures) >= workers * 2:
+                    yield futures.popleft().result()
+
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def get_error(shares, trials):
+    """Точность equity игроков: наибольшее расстояние от оценки до границ
+    доверительного интервала Уилсона (дисперсия доли банка не больше,
+    чем у Бернулли с тем же средним). В отличие от интервала Вальда,
+    он не вырождается в точку, если доля равна 0 или 1"""
+    z2 = CONFIDENCE_Z ** 2
+    error = 0.0
+    for share in shares:
+        p = share / trials
+        center = (p + z2 / (2 * trials)) / (1 + z2 / trials)
+        half_width = CONFIDENCE_Z / (1 + z2 / trials) * math.sqrt(
+            p * (1 - p) / trials + z2 / (4 * trials ** 2)
+        )
+        error = max(error, p - center + half_width, center + half_width - p)
+    return error
+
+
+def equity(players, board=(), jokers=False, max_trials=DEFAULT_MAX_TRIALS,
+           precision=DEFAULT_PRECISION, workers=1, seed=None,
+           batch_size=BATCH_SIZE):
+    """Оценивает шансы игроков методом Монте-Карло.
+    players - список карт каждого игрока, например [["AS", "AD"], ["KH", "QH"]]
+    board - известные карты борда
+    jokers - в колоде есть два джокера
+    Расчет останавливается после max_trials розыгрышей или когда
+    доверительный интервал equity каждого игрока не шире ±precision.
+    Возвращает словарь с количеством розыгрышей (trials), вероятностями
+    победы (win), ничьей (tie), долей банка (equity) по игрокам и
+    точностью (error)"""
+    players = [list(hole) for hole in players]
+    board = list(board)
+    check_cards(players, board)
+
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    seeds_rng = random.Random(seed)
+
+    def get_tasks():
+        for start in range(0, max_trials, batch_size):
+            trials = min(batch_size, max_trials - start)
+            yield players, board, trials, seeds_rng.getrandbits(64), jokers
+
+    trials = 0
+    wins = [0] * len(players)
+    ties = [0] * len(players)
+    shares = [0.0] * len(players)
+    error = 1.0
+
+    results = map_in_order(simulate, get_tasks(), workers)
+    try:
+        for batch_trials, batch_wins, batch_ties, batch_shares in results:
+            trials += batch_trials
+            for idx in range(len(players)):
+                wins[idx] += batch_wins[idx]
+                ties[idx] += batch_ties[idx]
+                shares[idx] += batch_shares[idx]
+
+            error = get_error(shares, trials)
+            if error <= precision:
+                break
+    finally:
+        results.close()
+
+    return {
+        "trials": trials,
+        "win": [count / trials for count in wins],
+        "tie": [count / trials for count in ties],
+        "equity": [share / trials for share in shares],
+        "error": error,
+    }
+
+
+def get_suit_symmetries(players, board, jokers=False):
+    """Возвращает перестановки мастей (словари карта -> карта),
+    при которых карты каждого игрока и борд не меняются.
+    Если в игре есть джокеры, масти переставляются только в пределах
+    цвета джокера"""
+    known_cards = [card for hole in players for card in hole] + board
+    has_jokers = jokers or any(
+        card in poker.JOKER_SUITS for card in known_cards
+    )
+
+    symmetries = []
+    for suits in permutations(poker.SUITS):
+        suit_map = dict(zip(poker.SUITS, suits))
+        if has_jokers and any(
+            set(suit_map[suit] for suit in joker_suits) != set(joker_suits)
+            for joker_suits in poker.JOKER_SUITS.values()
+        ):
+            continue
+
+        card_map = {card: card[:-1] + suit_map[card[-1]]
+                    for card in poker.CARD_CODES}
+        card_map.update((joker, joker) for joker in poker.JOKER_SUITS)
+        if all(set(card_map[card] for card in cards) == set(cards)
+               for cards in players + [board]):
+            symmetries.append(card_map)
+
+    return symmetries
+
+
+def exact_equity(players, board=(), jokers=False):
+    """Точные шансы игроков перебором всех досдач борда.
+    Результаты досдач кешируются по канонической досдаче (минимальной
+    среди её образов при перестановках мастей из get_suit_symmetries).
+    Возвращает словарь как у equity, где trials - количество досдач,
+    а evaluated - количество досдач, для которых оценивались руки"""
+    players = [list(hole) for hole in players]
+    board = list(board)
+    check_cards(players, board)
+
+    deck = get_deck(
+        set(card for hole in players for card in hole) | set(board), jokers
+    )
+    symmetries = get_suit_symmetries(players, board, jokers)
+    winners_cache = {}
+
+    trials = 0
+    wins = [0] * len(players)
+    ties = [0] * len(players)
+    shares = [0.0] * len(players)
+    for runout in combinations(deck, BOARD_SIZE - len(board)):
+        key = min(tuple(sorted(card_map[card] for card in runout))
+                  for card_map in symmetries)
+        winners = winners_cache.get(key)
+        if winners is None:
+            winners = winners_cache[key] = get_winners(
+                players, board + list(runout)
+            )
+
+        trials += 1
+        if len(winners) == 1:
+            wins[winners[0]] += 1
+        else:
+            for idx in winners:
+                ties[idx] += 1
+        for idx in winners:
+            shares[idx] += 1 / len(winners)
+
+    return {
+        "trials": trials,
+        "evaluated": len(winners_cache),
+        "win": [count / trials for count in wins],
+        "tie": [count / trials for count in ties],
+        "equity": [share / trials for share in shares],
+        "error": 0.0,
+    }
+
+
+def test_equity_known_board():
+    print("test_equity_known_board...")
+    result = equity([["AS", "AD"], ["KS", "KD"]],
+                    board="2C 7D 9H JS 3C".split(), seed=1)
+    assert result["win"] == [1.0, 0.0]
+    assert result["trials"] == BATCH_SIZE
+    result = equity([["AS", "2D"], ["AD", "3D"]],
+                    board="KC KD QH QS JC".split(), seed=1)
+    assert result["tie"] == [1.0, 1.0] and result["equity"] == [0.5, 0.5]
+    print('OK')
+
+
+def test_equity_preflop():
+    print("test_equity_preflop...")
+    result = equity([["AS", "AD"], ["KS", "KD"]], precision=0.01, seed=1)
+    assert abs(result["equity"][0] - 0.82) < 0.02
+    assert result["error"] <= 0.01
+    assert abs(sum(result["equity"]) - 1) < 1e-9
+    print('OK')
+
+
+def test_equity_workers():
+    print("test_equity_workers...")
+    args = ([["AS", "KS"], ["QH", "QD"], ["7C", "8C"]], "2S 9C TD".split())
+    kwargs = {"max_trials": 4000, "batch_size": 500, "seed": 2}
+    assert equity(*args, **kwargs) == equity(*args, workers=2, **kwargs)
+    print('OK')
+
+
+def test_exact_equity():
+    print("test_exact_equity...")
+    players = [["AS", "AD"], ["KS", "KD"]]
+    board = "2C 7H 8C".split()
+    result = exact_equity(players, board)
+    assert result["trials"] == 45 * 44 // 2
+    # Пики и бубны можно поменять местами: по лемме Бернсайда досдач
+    # с точностью до перестановки (990 + неподвижные досдачи) / 2, где
+    # неподвижные - 2 карты треф и червей или пики и бубны одного ранга
+    assert result["evaluated"] == (990 + 23 * 22 // 2 + 11) // 2
+
+    deck = get_deck(set(players[0] + players[1] + board))
+    shares = [0.0, 0.0]
+    for runout in combinations(deck, 2):
+        winners = get_winners(players, board + list(runout))
+        for idx in winners:
+            shares[idx] += 1 / len(winners)
+    assert result["equity"] == [share / result["trials"] for share in shares]
+
+    assert len(get_suit_symmetries([["AS", "KH"], ["?B", "2D"]], [])) == 1
+    assert len(get_suit_symmetries([["AS", "AD"], ["AC", "AH"]], [])) == 4
+    assert len(get_suit_symmetries([["AS", "AD", "AC", "AH"],
+                                    ["KS", "KD", "KC", "KH"]], [])) == 24
+    print('OK')
+
+
+def test_equity_error():
+    print("test_equity_error...")
+    players = [["AS", "AD"], ["KC", "KD"]]
+    board = "AH 7C 2D".split()
+    exact = exact_equity(players, board)["equity"]
+    for seed in [0, 12, 17]:
+        result = equity(players, board, seed=seed)
+        assert result["error"] > 0
+        assert all(abs(share - exact_share) <= result["error"]
+                   for share, exact_share in zip(result["equity"], exact))
+    assert get_error([0.0, 100.0], 100) > 0.03
+    print('OK')
+
+
+def test_equity_jokers():
+    print("test_equity_jokers...")
+    result = equity([["AS", "?B"], ["KH", "KD"]], "2S 9C TD 3H".split(),
+                    jokers=True, max_trials=300, seed=3)
+    assert result["trials"] == 300
+    assert abs(sum(result["equity"]) - 1) < 1e-9
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_equity_known_board()
+    test_equity_preflop()
+    test_equity_workers()
+    test_exact_equity()
+    test_equity_error()
+    test_equity_jokers()